@@ -0,0 +1,51 @@
+"""
+Fast NumPy loader against the VTK readers.
+
+    python -m benchmarks.bench_loader --sizes 10 100 500
+"""
+import argparse
+import gc
+import os
+import time
+
+from benchmarks.synthetic import generate, bytes_per_triangle, WRITERS
+from src.Visualisator.MeshBuilderVTK import MeshBuilderVTK
+from src.Visualisator.MeshLoaderNumpy import load_mesh
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '.data')
+
+
+def timed(load, filename):
+    gc.collect()
+    start = time.perf_counter()
+    mesh = load(filename)
+    return time.perf_counter() - start, mesh
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500], help='File sizes, MB')
+    parser.add_argument('--kinds', nargs='+', default=list(WRITERS), choices=list(WRITERS))
+    parser.add_argument('--data', default=DATA_DIR, help='Where generated models are kept')
+    args = parser.parse_args()
+
+    print(f'{"file":<40} {"MB":>7} {"triangles":>10} {"vtk, s":>8} {"numpy, s":>9} {"speedup":>8}')
+    for kind in args.kinds:
+        per_triangle = bytes_per_triangle(kind)
+        for size in args.sizes:
+            filename = generate(args.data, kind, int(size * 2 ** 20 / per_triangle))
+            # Reader is picked by the last extension: '.ascii.stl' is still STL
+            vtk_time, vtk_mesh = timed(lambda f: MeshBuilderVTK(f).build_mesh_vtk(), filename)
+            vtk_cells = vtk_mesh.GetNumberOfCells()
+            del vtk_mesh
+            fast_time, fast_mesh = timed(load_mesh, filename)
+
+            if fast_mesh.n_cells != vtk_cells:
+                print(f'  ! triangle count differs: vtk {vtk_cells}, numpy {fast_mesh.n_cells}')
+            print(f'{os.path.basename(filename):<40} {os.path.getsize(filename) / 2 ** 20:>7.1f} '
+                  f'{fast_mesh.n_cells:>10} {vtk_time:>8.2f} {fast_time:>9.2f} {vtk_time / fast_time:>7.1f}x')
+            del fast_mesh
+
+
+if __name__ == '__main__':
+    main()
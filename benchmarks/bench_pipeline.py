@@ -0,0 +1,226 @@
+"""
+Render pipeline on synthetic models, offscreen and without Telegram.
+Every case runs in a fresh process, so peak RSS belongs to that case only.
+Also startup: import time of the bot frontend, which must not load the visualization stack.
+
+    python -m benchmarks.bench_pipeline --triangles 1000 100000 --save-baseline
+    python -m benchmarks.bench_pipeline --triangles 1000 100000
+
+Exit code is 1 if a case is slower or bigger than the baseline by more than --tolerance
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks.synthetic import generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(os.path.dirname(__file__), '.data')
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Metric -> smallest difference that counts, regressions below it are noise
+COMPARED = {
+    'load_s': 0.05,
+    'build_s': 0.05,
+    'decimate_s': 0.05,
+    'frame_p50_ms': 2.0,
+    'encode_s': 0.05,
+    'save_s': 0.05,
+    'total_s': 0.1,
+    'peak_rss_mb': 20.0,
+    'import_s': 0.05,
+}
+
+# Only render workers may load these
+HEAVY_MODULES = ('vtk', 'vtkmodules', 'pyvista', 'imageio', 'matplotlib')
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def measure_startup(runs=5):
+    """Import time of the bot frontend in a fresh interpreter (best of runs) and heavy modules it loads"""
+    code = (
+        'import sys, time\n'
+        'start = time.perf_counter()\n'
+        'import src.Client\n'
+        'print(time.perf_counter() - start)\n'
+        f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n'
+    )
+    times = []
+    heavy_modules = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+        lines = out.stdout.splitlines()
+        times.append(float(lines[0]))
+        heavy_modules = [m for m in lines[1].split(',') if m] if len(lines) > 1 else []
+    return {'import_s': min(times), 'heavy_modules': heavy_modules}
+
+
+def run_case(filename, frames, triangle_budget):
+    """One model through the pipeline. Runs in its own process"""
+    from src.DebugPrinter import DPrint
+    from src.Visualisator.HandlerModel import HandlerModel
+    from src.Visualisator.MeshBuilderVTK import MeshBuilderVTK
+    from src.Visualisator.RenderPyVista import create_plotter, Visualizer
+
+    # Like a warmed up render worker
+    plotter = create_plotter()
+    Visualizer.warm_up(plotter)
+
+    start = time.perf_counter()
+    mesh = MeshBuilderVTK(filename).build_mesh()
+    load_s = time.perf_counter() - start
+    del mesh
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        res = HandlerModel(
+            full_filename=filename,
+            frames=frames,
+            dprint=DPrint('BENCH'),
+            output_filename=os.path.join(directory, 'bench.mp4'),
+            plotter=plotter,
+            triangle_budget=triangle_budget,
+            is_mesh_cache=False,
+        ).process()
+        total_s = time.perf_counter() - start
+        if res is None or not isinstance(res.image, str):
+            raise RuntimeError(f'Failed to render {filename}')
+        output_kb = os.path.getsize(res.image) / 2 ** 10
+
+    return {
+        'triangles': res.triangles,
+        'load_s': load_s,
+        'build_s': res.timings.get('build_mesh', 0.0),
+        'decimate_s': res.timings.get('decimate', 0.0),
+        'frame_p50_ms': statistics.median(res.frame_seconds) * 1000,
+        'frame_max_ms': max(res.frame_seconds) * 1000,
+        'encode_s': res.timings.get('encode', 0.0),
+        'save_s': res.timings.get('save', 0.0),
+        'total_s': total_s,
+        'peak_rss_mb': peak_rss_mb(),
+        'output_kb': output_kb,
+    }
+
+
+def machine():
+    import vtkmodules
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'vtk': getattr(vtkmodules, '__version__', None),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns the list of regressions"""
+    regressions = []
+    heavy_modules = results.get('startup', {}).get('heavy_modules')
+    if heavy_modules:
+        regressions.append(f'startup: the bot frontend loads {", ".join(heavy_modules)}')
+
+    for case, metrics in results.items():
+        base = baseline.get('cases', {}).get(case)
+        if base is None:
+            continue
+        for metric, floor in COMPARED.items():
+            old, new = base.get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > floor:
+                regressions.append(f'{case}: {metric} {old:.3f} -> {new:.3f} (+{(new / old - 1) * 100 if old else 0:.0f}%)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--triangles', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000, 5_000_000])
+    parser.add_argument('--kinds', nargs='+', default=['stl', 'obj'], choices=['stl', 'ascii.stl', 'obj'])
+    parser.add_argument('--noise', type=float, nargs='+', default=[0.0, 0.01],
+                        help='Relative radial noise: 0 - smooth sphere, 0.01 - like a scan')
+    parser.add_argument('--frames', type=int, default=36)
+    parser.add_argument('--triangle-budget', type=int, default=300_000)
+    parser.add_argument('--data', default=DATA_DIR, help='Where generated models are kept')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='UTF8') as f:
+            baseline = json.load(f)
+        if baseline.get('machine') != machine():
+            print('! Baseline is from another machine or library versions, compare with care')
+
+    results = {'startup': measure_startup()}
+    startup = results['startup']
+    print(f'Startup: import src.Client {startup["import_s"]:.2f} s, '
+          f'heavy modules: {", ".join(startup["heavy_modules"]) or "none"}')
+
+    header = (f'{"case":<24} {"triangles":>10} {"load s":>7} {"build s":>8} {"decim s":>8} '
+              f'{"frame ms":>9} {"encode s":>9} {"save s":>7} {"total s":>8} {"RSS MB":>7} {"out KB":>7}')
+    print(header)
+
+    for kind in args.kinds:
+        for noise in args.noise:
+            for triangles in args.triangles:
+                case = f'{kind}_{triangles}_{noise:g}'
+                filename = generate(args.data, kind, triangles, noise)
+                # A fresh process per case: clean peak RSS, no state left from the previous one
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    metrics = executor.submit(run_case, filename, args.frames, args.triangle_budget).result()
+                results[case] = metrics
+
+                m = metrics
+                rss = f'{m["peak_rss_mb"]:>7.0f}' if m['peak_rss_mb'] is not None else f'{"-":>7}'
+                print(f'{case:<24} {m["triangles"]:>10} {m["load_s"]:>7.2f} {m["build_s"]:>8.2f} '
+                      f'{m["decimate_s"]:>8.2f} {m["frame_p50_ms"]:>9.1f} {m["encode_s"]:>9.2f} '
+                      f'{m["save_s"]:>7.2f} {m["total_s"]:>8.2f} {rss} {m["output_kb"]:>7.0f}')
+
+    report = {'machine': machine(), 'frames': args.frames, 'triangle_budget': args.triangle_budget, 'cases': results}
+    if args.json:
+        with open(args.json, 'w', encoding='UTF8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='UTF8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Baseline saved: {args.baseline}')
+        return 0
+
+    if baseline is None:
+        print('No baseline to compare with, run with --save-baseline first')
+        return 0
+
+    if (baseline.get('frames'), baseline.get('triangle_budget')) != (args.frames, args.triangle_budget):
+        print('! Baseline is made with other --frames or --triangle-budget')
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if not regressions:
+        print('No regressions against the baseline')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
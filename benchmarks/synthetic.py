@@ -0,0 +1,95 @@
+"""Procedurally generated meshes for benchmarks"""
+import math
+import os
+
+import numpy as np
+
+from src.Visualisator.MeshLoaderNumpy import STL_RECORD, STL_HEADER_SIZE
+
+
+def sphere(triangles: int, noise: float = 0.0, seed: int = 0):
+    """
+    UV sphere with about `triangles` triangles.
+    noise - relative radial noise, imitates a scan
+    Returns points (N, 3) float32 and triangles (M, 3) int64
+    """
+    res = max(3, math.ceil(math.sqrt(triangles / 2)))
+    theta = np.linspace(0, 2 * np.pi, res, endpoint=False)
+    phi = np.linspace(0, np.pi, res + 1)[1:-1]
+
+    t, p = np.meshgrid(theta, phi)
+    radius = np.ones_like(t)
+    if noise:
+        radius += np.random.default_rng(seed).normal(0, noise, t.shape)
+    ring = np.stack([radius * np.sin(p) * np.cos(t), radius * np.sin(p) * np.sin(t), radius * np.cos(p)], axis=-1)
+    points = np.concatenate([[[0, 0, 1]], ring.reshape(-1, 3), [[0, 0, -1]]]).astype(np.float32)
+
+    rows = len(phi)
+    idx = 1 + np.arange(rows * res).reshape(rows, res)
+    nxt = np.roll(idx, -1, axis=1)
+    top = np.stack([np.zeros(res, dtype=np.int64), nxt[0], idx[0]], axis=1)
+    bottom = np.stack([np.full(res, len(points) - 1), idx[-1], nxt[-1]], axis=1)
+    a, b, c, d = idx[:-1], nxt[:-1], idx[1:], nxt[1:]
+    body = np.concatenate([
+        np.stack([a, b, c], axis=-1).reshape(-1, 3),
+        np.stack([b, d, c], axis=-1).reshape(-1, 3),
+    ])
+    return points, np.concatenate([top, body, bottom]).astype(np.int64)
+
+
+def write_binary_stl(filename, points, triangles):
+    records = np.zeros(len(triangles), dtype=STL_RECORD)
+    records['vertices'] = points[triangles]
+    with open(filename, 'wb') as f:
+        f.write(b'synthetic'.ljust(80, b' '))
+        f.write(np.uint32(len(triangles)).tobytes())
+        records.tofile(f)
+    assert os.path.getsize(filename) == STL_HEADER_SIZE + len(triangles) * STL_RECORD.itemsize
+
+
+def write_ascii_stl(filename, points, triangles, block=100_000):
+    facet = ('facet normal 0 0 0\n outer loop\n'
+             '  vertex %.6f %.6f %.6f\n  vertex %.6f %.6f %.6f\n  vertex %.6f %.6f %.6f\n'
+             ' endloop\nendfacet\n')
+    with open(filename, 'w') as f:
+        f.write('solid synthetic\n')
+        for start in range(0, len(triangles), block):
+            corners = points[triangles[start:start + block]].reshape(-1, 9)
+            f.write(''.join(facet % tuple(row) for row in corners.tolist()))
+        f.write('endsolid synthetic\n')
+
+
+def write_obj(filename, points, triangles, block=100_000):
+    with open(filename, 'w') as f:
+        for start in range(0, len(points), block):
+            f.write(''.join('v %.6f %.6f %.6f\n' % tuple(row) for row in points[start:start + block].tolist()))
+        for start in range(0, len(triangles), block):
+            f.write(''.join('f %d %d %d\n' % tuple(row) for row in (triangles[start:start + block] + 1).tolist()))
+
+
+WRITERS = {
+    'stl': write_binary_stl,
+    'ascii.stl': write_ascii_stl,
+    'obj': write_obj,
+}
+
+
+def generate(directory, kind, triangles, noise=0.0):
+    """Creates (or reuses) a synthetic model file and returns its name"""
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, f'sphere_{triangles}_{noise:g}.{kind}')
+    if not os.path.exists(filename):
+        points, faces = sphere(triangles, noise)
+        tmp_filename = filename + '.tmp'
+        WRITERS[kind](tmp_filename, points, faces)
+        os.replace(tmp_filename, filename)
+    return filename
+
+
+def bytes_per_triangle(kind):
+    """Measured on a small sample, to pick a triangle count for a wanted file size"""
+    if kind == 'stl':
+        return STL_RECORD.itemsize
+    sample = 20_000
+    filename = generate(os.path.join(os.path.dirname(__file__), '.data'), kind, sample)
+    return os.path.getsize(filename) / len(sphere(sample)[1])
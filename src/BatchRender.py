@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+from dataclasses import dataclass, field, asdict
+
+from .ConfigApi import ConfigApi
+from .DebugPrinter import DPrint
+from .LogSink import sink, LogSettings
+from .RenderCache import RenderCache
+from .Visualisator.Encoder import EncoderSettings
+from .Visualisator.RenderPool import RenderPool, RenderJob
+
+MODEL_EXTENSIONS = ('.stl', '.obj')
+
+dprint = DPrint('BATCH')
+
+
+def find_models(patterns: list[str]) -> list[str]:
+    """Models of directory trees and glob patterns (** - any depth), sorted, each once"""
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                found.update(os.path.join(root, name) for name in files)
+        else:
+            found.update(glob.glob(pattern, recursive=True))
+    return sorted(os.path.abspath(filename) for filename in found
+                  if filename.lower().endswith(MODEL_EXTENSIONS) and os.path.isfile(filename))
+
+
+@dataclass
+class RenderSettings:
+    frames: int = 120
+    encoder: EncoderSettings = EncoderSettings()
+    triangle_budget: int | None = 300_000
+    workers: int | None = None
+    split_workers: int = 1
+    job_queue: str = ''
+    log: LogSettings = field(default_factory=LogSettings)
+
+    @classmethod
+    def from_config(cls, filename: str, frames: int) -> 'RenderSettings':
+        """Render parameters and the log of the bot, so its cache keys match. Defaults if there is no config"""
+        if not os.path.exists(filename):
+            dprint.warn(f'No config "{filename}", default render parameters are used')
+            return cls(frames=frames)
+        config = ConfigApi(filename)
+        return cls(
+            frames=frames,
+            encoder=EncoderSettings(fps=config.encoder_fps, preset=config.encoder_preset, crf=config.encoder_crf),
+            triangle_budget=config.triangle_budget,
+            workers=config.render_workers,
+            split_workers=config.split_workers,
+            job_queue=config.job_queue,
+            log=LogSettings.from_config(config),
+        )
+
+    @property
+    def params(self) -> str:
+        # The same as the bot uses for the render cache keys
+        return RenderCache.params_key(frames=self.frames, encoder=self.encoder, triangle_budget=self.triangle_budget)
+
+
+@dataclass
+class ManifestEntry:
+    source_size: int
+    source_mtime_ns: int
+    params: str
+    key: str
+    video_filename: str | None
+    volume_mm3: float = 0.0
+    triangles: int = 0
+    timings: dict[str, float] = field(default_factory=dict)  # Stage -> seconds
+    ok: bool = True
+
+
+class Manifest:
+    """Results of batch runs by model filename: stats of each model and what is up to date"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.entries: dict[str, ManifestEntry] = {}
+        try:
+            with open(filename, 'r', encoding='UTF8') as f:
+                self.entries = {source: ManifestEntry(**entry) for source, entry in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError) as e:
+            dprint.warn(f'Manifest is unreadable, starting empty: {e}')
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w', encoding='UTF8') as f:
+            json.dump({source: asdict(entry) for source, entry in self.entries.items()}, f, indent=1)
+        os.replace(tmp_filename, self.filename)
+
+
+@dataclass
+class BatchStats:
+    rendered: int = 0
+    skipped: int = 0
+    failed: int = 0
+    triangles: int = 0
+    frames: int = 0
+    render_seconds: float = 0.0  # Sum over models, wall time of each
+
+
+class BatchRender:
+    """
+    Renders model catalogs into the render cache of the bot, without Telegram.
+    Models whose video is up to date are skipped: by the manifest (source size and mtime) without reading them,
+    or by the render cache key (content hash and render parameters) when the same model is somewhere else
+    """
+
+    def __init__(self, settings: RenderSettings, output: str, manifest_filename: str, force: bool = False):
+        self.settings = settings
+        self.force = force
+        self.render_cache = RenderCache(output, dprint)
+        self.manifest = Manifest(manifest_filename)
+        self.pool = RenderPool(settings.workers, dprint, settings.encoder)
+        self.stats = BatchStats()
+
+    def up_to_date(self, source: str, size: int, mtime_ns: int) -> bool:
+        entry = self.manifest.entries.get(source)
+        return (not self.force and entry is not None and entry.ok
+                and (entry.source_size, entry.source_mtime_ns, entry.params) == (size, mtime_ns, self.settings.params)
+                and entry.video_filename is not None and os.path.exists(entry.video_filename))
+
+    async def render_model(self, source: str) -> str:
+        """Returns the outcome: 'skipped', 'rendered' or 'failed'"""
+        st = await asyncio.to_thread(os.stat, source)
+        if self.up_to_date(source, st.st_size, st.st_mtime_ns):
+            return 'skipped'
+
+        content_hash = await asyncio.to_thread(RenderCache.file_hash, source)
+        key = RenderCache.make_key(content_hash, self.settings.params)
+        entry = ManifestEntry(st.st_size, st.st_mtime_ns, self.settings.params, key, None)
+
+        cached = await asyncio.to_thread(self.render_cache.get, key)
+        if not self.force and cached is not None and cached.is_video_present:
+            entry.video_filename = cached.video_filename
+            entry.volume_mm3 = cached.volume_mm3
+            self.manifest.entries[source] = entry
+            return 'skipped'
+
+        start = time.perf_counter()
+        res = await self.pool.submit_split(RenderJob(
+            full_filename=source,
+            frames=self.settings.frames,
+            output_filename=self.render_cache.video_filename(key),
+            encoder=self.settings.encoder,
+            triangle_budget=self.settings.triangle_budget,
+        ), self.settings.split_workers)
+        seconds = time.perf_counter() - start
+
+        if res is None or res.video_filename is None:
+            entry.ok = False
+            self.manifest.entries[source] = entry
+            return 'failed'
+
+        await asyncio.to_thread(self.render_cache.put, key, res.video_filename, res.volume_mm3)
+        entry.video_filename = res.video_filename
+        entry.volume_mm3 = res.volume_mm3
+        entry.triangles = res.triangles
+        entry.timings = {**res.timings, 'total': seconds}
+        self.manifest.entries[source] = entry
+
+        self.stats.triangles += res.triangles
+        self.stats.frames += self.settings.frames
+        self.stats.render_seconds += seconds
+        return 'rendered'
+
+    async def run(self, models: list[str]) -> BatchStats:
+        queue = asyncio.Queue()
+        for source in models:
+            queue.put_nowait(source)
+        done = [0]
+
+        async def runner():
+            while not queue.empty():
+                source = queue.get_nowait()
+                try:
+                    outcome = await self.render_model(source)
+                except Exception as e:
+                    dprint.error(f'"{source}": {e}')
+                    outcome = 'failed'
+                setattr(self.stats, outcome, getattr(self.stats, outcome) + 1)
+                done[0] += 1
+                if outcome != 'skipped':
+                    self.manifest.save()
+                dprint(f'[{done[0]}/{len(models)}] {outcome}: {source}')
+
+        try:
+            # Enough jobs in flight to keep every worker busy, the pool queues the rest
+            await asyncio.gather(*[runner() for _ in range(min(self.pool.workers, len(models)))])
+        finally:
+            self.pool.shutdown()
+            self.manifest.save()
+        return self.stats
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('models', nargs='+', help="Directories and glob patterns, e.g. DATA/ or 'DATA/**/*.stl'")
+    parser.add_argument('--output', default='./Videos', help='Render cache directory of the bot')
+    parser.add_argument('--manifest', help='Stats of every model, default: <output>/batch_manifest.json')
+    parser.add_argument('--config', default='./src/Config/config.json',
+                        help='Bot config with render parameters, so the bot finds the videos in its cache')
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--workers', type=int, help='Render processes, default: from the config')
+    parser.add_argument('--split', type=int, help='Workers per model (for a few huge models), default: from the config')
+    parser.add_argument('--force', action='store_true', help='Render up to date models too')
+
+
+async def main(args: argparse.Namespace) -> int:
+    settings = RenderSettings.from_config(args.config, args.frames)
+    sink.configure(settings.log)
+
+    models = find_models(args.models)
+    if not models:
+        dprint.error('No .stl or .obj models found')
+        return 1
+    if args.workers is not None:
+        settings.workers = args.workers
+    if args.split is not None:
+        settings.split_workers = args.split
+
+    manifest = args.manifest or os.path.join(args.output, 'batch_manifest.json')
+    batch = BatchRender(settings, args.output, manifest, force=args.force)
+    dprint(f'{len(models)} models, {batch.pool.workers} workers')
+
+    # Throughput is measured with warm workers
+    await batch.pool.warm_up()
+    start = time.perf_counter()
+    stats = await batch.run(models)
+    wall = time.perf_counter() - start
+
+    dprint.success(f'Rendered {stats.rendered}, up to date {stats.skipped}, failed {stats.failed} '
+                   f'in {wall:.1f} s. Manifest: {manifest}')
+    if stats.rendered:
+        dprint.success(f'Throughput: {stats.rendered / wall * 60:.1f} models/min, {stats.frames / wall:.1f} frames/s, '
+                       f'{stats.triangles / wall:.0f} triangles/s, '
+                       f'{stats.render_seconds / stats.rendered:.1f} s per model')
+    return 1 if stats.failed else 0
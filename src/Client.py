@@ -1,21 +1,85 @@
+import asyncio
 import os
+import time
+from io import BytesIO
 
 import telethon
-from telethon import events, TelegramClient
+from telethon import errors, events, utils, TelegramClient
 from telethon.tl.custom import Button
-from telethon.tl.types import DocumentAttributeFilename
+from telethon.tl.types import DocumentAttributeFilename, DocumentAttributeVideo
 
 from .ConfigApi import ConfigApi
 from .DebugPrinter import DPrint
+from .LogSink import sink, LogSettings
+from . import Metrics
+from .Metrics import MetricsServer
+from .OutboundDispatcher import OutboundDispatcher, RESULT, STATUS
+from .JobScheduler import JobScheduler, QueueFullError
+from .JobQueue import JobQueue, QueuedRenderer
+from .Preflight import Preflight, PreflightError
 from .Downloader import get_extension, FileDownloaderFromMessage, get_bare_filename
-from .Visualisator.HandlerModel import HandlerModel
+from .RenderCache import RenderCache, CachedRender
+from .Uploader import Uploader
+from .Visualisator.Encoder import EncoderSettings
+from .Visualisator.MeshCache import MeshCache
+from .Visualisator.MeshLoaderNumpy import BinaryStlStream
+from .Visualisator.RenderPool import RenderPool, RenderJob, RenderResult
 
 dprint = DPrint('BOT')
 
+
+class StatusMessage:
+    """One message per job, edited on every status change. Changes waiting for their turn are coalesced"""
+
+    def __init__(self, outbox: OutboundDispatcher, who):
+        self.outbox = outbox
+        self.who = who
+        self.msg = None
+        self.text = None
+        self.sent_text = None
+        self.is_closed = False
+        self.lock = asyncio.Lock()
+
+    async def set(self, text):
+        if self.is_closed or text == self.text:
+            return
+        self.text = text
+        await self.outbox.send(self.who, self._send, priority=STATUS, key=self)
+
+    async def _send(self):
+        # The latest text, whenever the turn comes
+        async with self.lock:
+            if self.is_closed or self.text == self.sent_text:
+                return
+            text = self.text
+            if self.msg is None:
+                self.msg = await self.outbox.client.send_message(self.who, text)
+            else:
+                await self.msg.edit(text)
+            self.sent_text = text
+
+    async def set_queue_position(self, position):
+        if position:
+            await self.set(f"Your model is in the queue, position {position}")
+        else:
+            await self.set("Rendering your model...")
+
+    async def delete(self):
+        async with self.lock:
+            self.is_closed = True
+            msg, self.msg = self.msg, None
+        if msg is not None:
+            try:
+                await self.outbox.send(self.who, msg.delete, priority=STATUS)
+            except Exception as e:
+                dprint.warn(f"Failed to delete status message: {e}")
+
+
 class Client(telethon.TelegramClient):
     def __init__(self, config: ConfigApi):
         self.config = config
         super().__init__('TestBot', config.api_key, config.api_hash)
+        self.started = asyncio.Event()  # Logged in, messages can be sent
 
     async def _login(self):
         if not await self.is_user_authorized():
@@ -32,6 +96,7 @@ class Client(telethon.TelegramClient):
         dprint("Bot is logining...")
         # await self._login()
         await self.start(bot_token=self.config.bot_token)
+        self.started.set()
 
         dprint("Bot is waiting for messages...")
         await self.run_until_disconnected()
@@ -42,43 +107,267 @@ class Client(telethon.TelegramClient):
 class Logic:
     def __init__(self):
         self.client = Client(ConfigApi('./src/Config/config.json'))
+        config = self.client.config
+        sink.configure(LogSettings.from_config(config))
+        self.encoder = EncoderSettings(
+            fps=config.encoder_fps,
+            preset=config.encoder_preset,
+            crf=config.encoder_crf,
+        )
+        # Rendering is done either by the local pool or by render workers through the job queue
+        self.render_pool = None
+        self.job_queue = None
+        if config.job_queue:
+            self.job_queue = QueuedRenderer(JobQueue(config.job_queue), dprint)
+        else:
+            self.render_pool = RenderPool(config.render_workers, dprint, self.encoder)
+        self.render_cache = RenderCache('./Videos', dprint)
+        self.rendering: dict[str, asyncio.Future] = {}  # Render key -> result of the render in progress
+        self.started_at = time.time()
+        self.tasks: set[asyncio.Task] = set()
+        # Jobs are not limited by the bot host: downloads and streamed parsing have their own limits
+        self.download_slots = asyncio.Semaphore(config.download_max_concurrent)
+        self.stream_slots = asyncio.Semaphore(config.download_stream_parse_max_concurrent)
+        self.uploader = Uploader(self.client, dprint, connections=config.upload_connections)
+        self.outbox = OutboundDispatcher(
+            self.client,
+            dprint,
+            rate=config.send_rate,
+            chat_rate=config.send_chat_rate,
+            chat_burst=config.send_chat_burst,
+            max_flood_wait=config.send_max_flood_wait,
+        )
+        self.scheduler = JobScheduler(
+            concurrency=config.max_concurrent_jobs,
+            per_user_in_flight=config.per_user_in_flight,
+            max_queue=config.max_queue,
+            max_queue_per_user=config.max_queue_per_user,
+            dprint=dprint,
+            heavy_concurrency=config.heavy_concurrent_jobs,
+            heavy_cost=config.heavy_job_seconds,
+            aging=config.queue_aging,
+        )
+        self.preflight = Preflight(
+            self.client,
+            max_file_size=config.max_file_mb << 20,
+            max_triangles=config.max_triangles,
+            max_memory=config.max_memory_mb << 20,
+            triangle_budget=config.triangle_budget,
+            dprint=dprint,
+        )
+        Metrics.registry.collectors.append(self.collect_queue_metrics)
         self.client.add_event_handler(self.model_message_handler)
         self.client.add_event_handler(self.button_handler)
         self.client.add_event_handler(self.inline_button_handler)
 
     async def run(self):
+        # Workers are warming up while the bot is connecting
+        self.warm_up_task = asyncio.create_task((self.job_queue or self.render_pool).warm_up())
+        if self.job_queue is not None:
+            self.resume_task = asyncio.create_task(self.resume_deliveries())
+        config = self.client.config
+        if config.metrics_port:
+            try:
+                await MetricsServer(config.metrics_host, config.metrics_port, dprint).start()
+            except OSError as e:
+                dprint.error(f"Metrics endpoint is not available: {e}")
         await self.client.run()
 
-    def convert(self, file, frames=120):
-        handled_model = HandlerModel(
-            full_filename=file,
-            frames=frames,
-            dprint=DPrint(prefix='GifRender', is_without_repeats=False),
-        )
-
-        res = handled_model.process()
+    def close(self):
+        if self.render_pool is not None:
+            self.render_pool.shutdown()
+
+    def collect_queue_metrics(self):
+        for lane in self.scheduler.stats():
+            Metrics.queue_jobs.set(lane.running, lane=lane.name, state='running')
+            Metrics.queue_jobs.set(lane.queued, lane=lane.name, state='queued')
+
+    @staticmethod
+    def observe_render(res: RenderResult):
+        """Stage timings measured inside the worker"""
+        for stage, seconds in res.timings.items():
+            Metrics.stage_seconds.observe(seconds, stage=stage)
+        for seconds in res.frame_seconds:
+            Metrics.frame_seconds.observe(seconds)
+        if res.triangles:
+            Metrics.model_triangles.observe(res.triangles)
+        Metrics.cache_total.inc(cache='mesh', result='hit' if res.is_mesh_cached else 'miss')
+
+    async def render(self, job: RenderJob, delivery: dict | None = None) -> RenderResult | None:
+        """delivery - where a render worker's video goes if the bot is restarted meanwhile"""
+        if self.job_queue is not None:
+            return await self.job_queue.submit(job, delivery)
+        if job.preview_size is None:
+            return await self.render_pool.submit_split(job, self.client.config.split_workers)
+        return await self.render_pool.submit(job)
+
+    async def convert(self, file, frames=120, video_filename=None, delivery=None):
+        if video_filename is None:
+            video_filename = './Videos/' + get_bare_filename(file) + '.mp4'
+
+        with Metrics.stage_seconds.time(stage='render'):
+            res = await self.render(RenderJob(
+                full_filename=file,
+                frames=frames,
+                output_filename=video_filename,
+                encoder=self.encoder,
+                triangle_budget=self.client.config.triangle_budget,
+            ), delivery)
 
         # Check if processing was successful
-        if res is None or res.image is None:
+        if res is None or not res.ok:
             dprint.error(f"Failed to process model: {file}")
             return None
 
-        # Save to file if successful
-        os.makedirs('./Videos', exist_ok=True)
+        self.observe_render(res)
+        if res.video_filename is not None:
+            dprint.success(f"Video saved: {res.video_filename}")
+        return res
+
+    async def render_preview(self, file, frames) -> RenderResult | None:
+        """Small still with the volume, rendered as soon as the mesh is built"""
+        with Metrics.stage_seconds.time(stage='preview'):
+            res = await self.render(RenderJob(
+                full_filename=file,
+                frames=frames,
+                encoder=self.encoder,
+                triangle_budget=self.client.config.triangle_budget,
+                preview_size=self.client.config.preview_size,
+            ))
+        if res is None or res.preview is None:
+            dprint.warn(f"No preview of {file}")
+            return None
+
+        for stage, seconds in res.timings.items():
+            Metrics.stage_seconds.observe(seconds, stage=stage)
+        return res
+
+    async def send_preview(self, who, res: RenderResult):
+        """Returns the message or None"""
+        photo = BytesIO(res.preview)
+        photo.name = 'preview.jpg'
         try:
-            with open('./Videos/' + get_bare_filename(file) + '.mp4', 'wb') as f:
-                f.write(res.image.getbuffer())
-            dprint.success(f"Video saved: ./Videos/{get_bare_filename(file)}.mp4")
+            return await self.outbox.send_file(
+                who, file=photo, caption=f"Volume: {res.volume_mm3:.2f} mm³\nRendering the video...")
         except Exception as e:
-            dprint.error(f"Failed to save video: {e}")
+            dprint.warn(f"Failed to send preview: {e}")
+            return None
 
-        res.image.seek(0)
-        return res.image
+    async def download(self, msg, file_name, stream: BinaryStlStream | None = None):
+        file_downloader = FileDownloaderFromMessage(
+            self.client, msg, file_name, 20, dprint,
+            connections=self.client.config.download_connections,
+            range_size=self.client.config.download_range_mb << 20,
+            on_data=stream.feed if stream is not None else None,
+        )
+        await file_downloader.init()
+        with Metrics.stage_seconds.time(stage='download'):
+            full_file_name = await file_downloader.run()
+        Metrics.bytes_total.inc(msg.file.size, direction='download')
+        return full_file_name
+
+    async def download_model(self, msg, file_name) -> str:
+        """
+        Waits for a download slot and downloads the model. Binary STL is parsed on the way if a stream slot
+        is free, otherwise by the render worker. Parsed vertices are saved right away to free the slot
+        """
+        async with self.download_slots:
+            stream = self.create_mesh_stream(msg, file_name) if not self.stream_slots.locked() else None
+            if stream is None:
+                return await self.download(msg, file_name)
+            async with self.stream_slots:
+                full_file_name = await self.download(msg, file_name, stream)
+                with Metrics.stage_seconds.time(stage='stream_mesh'):
+                    await asyncio.to_thread(self.save_streamed_mesh, stream, full_file_name)
+            return full_file_name
+
+    def create_mesh_stream(self, msg, file_name) -> BinaryStlStream | None:
+        """Binary STL is parsed while it is downloaded. Its arrays take ~1.2x of the file in the bot process"""
+        config = self.client.config
+        if not config.download_stream_parse or get_extension(file_name).lower() != 'stl':
+            return None
+        if msg.file.size > config.download_stream_parse_max_mb << 20:
+            # Huge models are parsed by the render worker
+            return None
+        stream = BinaryStlStream(msg.file.size)
+        return stream if stream.is_valid else None
+
+    @staticmethod
+    def save_streamed_mesh(stream: BinaryStlStream, full_file_name):
+        """
+        Blocking. Parsed vertices go next to the model, the render worker merges them and computes the volume
+        without parsing. Merging is not done here: it takes several times the memory of the vertices and VTK
+        """
+        if not stream.is_complete:
+            if stream.error is not None:
+                dprint.warn(f"Streamed parsing is not possible: {stream.error}")
+            return
+        try:
+            MeshCache(full_file_name).save_vertices(*stream.arrays())
+            dprint(f"Model parsed while downloading: {stream.count} triangles")
+        except Exception as e:
+            dprint.warn(f"Failed to save streamed vertices: {e}")
+
+    def video_attributes(self, file_name, frames):
+        if not file_name.endswith('.mp4'):
+            return None
+        width, height = RenderJob.window_size
+        return [DocumentAttributeVideo(
+            duration=frames / self.encoder.fps, w=width, h=height, supports_streaming=True)]
+
+    async def send_video(self, who, key, video: str | bytes, frames, preview_msg=None, caption=None):
+        """
+        video - filename or content. Uploaded once per render key, then only referenced:
+        retries and sends of the same render to other users don't upload it again.
+        preview_msg - replaced by the video with caption, if possible
+        """
+        file_name = os.path.basename(video) if isinstance(video, str) else 'visualization.mp4'
+        attributes = self.video_attributes(file_name, frames)
+
+        input_file = await self.uploader.upload(key, video, file_name)
+        if preview_msg is not None:
+            try:
+                # The video takes the place of the preview
+                return await self.outbox.edit_message(preview_msg, caption, file=input_file, attributes=attributes)
+            except Exception as e:
+                dprint.warn(f"Failed to replace preview with the video: {e}")
+
+        try:
+            return await self.outbox.send_file(who, file=input_file, attributes=attributes)
+        except (errors.FilePartMissingError, errors.FilePartsInvalidError) as e:
+            # Uploaded parts are gone from Telegram
+            dprint.warn(f"Uploaded video of {key} is not usable, uploading again: {e}")
+            self.uploader.forget(key)
+            input_file = await self.uploader.upload(key, video, file_name)
+            return await self.outbox.send_file(who, file=input_file, attributes=attributes)
+
+    async def send_cached(self, who, cached: CachedRender, frames):
+        """Answer from the render cache. Returns False if there is nothing to send"""
+        if cached.document is not None:
+            try:
+                await self.outbox.send_file(who, file=cached.input_document)
+                dprint.success(f"Sent cached visualization {cached.key} to {who} without upload")
+                return True
+            except Exception as e:
+                # File reference may be expired - the video is sent as a file below
+                dprint.warn(f"Cached document of {cached.key} is not usable: {e}")
+                await asyncio.to_thread(self.render_cache.forget_document, cached.key)
+
+        if not cached.is_video_present:
+            return False
+
+        msg = await self.send_video(who, cached.key, cached.video_filename, frames)
+        await asyncio.to_thread(self.render_cache.remember_document, cached.key, msg.document)
+        dprint.success(f"Sent cached visualization {cached.key} to {who}")
+        return True
 
     @events.register(events.NewMessage(incoming=True))
     async def model_message_handler(self, event: telethon.events.NewMessage.Event):
         who = event.message.peer_id
         file = event.message.media
+        if getattr(file, 'document', None) is None:
+            # Text, photos and other messages without a document
+            return
         file_name = list(filter(lambda att: isinstance(att, DocumentAttributeFilename), file.document.attributes))
         if file_name:
             file_name = file_name[0].file_name
@@ -92,26 +381,169 @@ class Logic:
                f"Message: {event.raw_text}\n,"
                f"File: {file}")
 
-        file_downloader = FileDownloaderFromMessage(self.client, event.message, file_name, 20, dprint)
-        await file_downloader.init()
-        full_file_name = await file_downloader.run()
+        started = time.perf_counter()
+        frames = 120
+        params = RenderCache.params_key(
+            frames=frames,
+            encoder=self.encoder,
+            triangle_budget=self.client.config.triangle_budget,
+        )
+        document_id = file.document.id
 
-        file_vis = self.convert(full_file_name)
+        cached = await asyncio.to_thread(self.render_cache.get_by_document, document_id, params)
+        Metrics.cache_total.inc(cache='document', result='hit' if cached is not None else 'miss')
+        try:
+            if cached is not None and await self.send_cached(who, cached, frames):
+                self.observe_request(started, 'cached')
+                return
+        except Exception as e:
+            dprint.error(f"Failed to send cached file: {e}")
+
+        try:
+            with Metrics.stage_seconds.time(stage='preflight'):
+                estimate = await self.preflight.check(event.message, file_name, frames)
+        except PreflightError as e:
+            dprint.warn(f"Refused model from {who}: {e}")
+            Metrics.requests_total.inc(result='refused')
+            await self.outbox.send_message(who, f"Sorry, I can't render this model. {e}", priority=RESULT)
+            return
+        except Exception as e:
+            # Preflight is an optimization - the model is still rendered without it
+            dprint.warn(f"Preflight failed: {e}")
+            estimate = None
+
+        status = StatusMessage(self.outbox, who)
+        try:
+            result = await self.scheduler.submit(
+                event.sender_id,
+                lambda: self.process_model(event.message, file_name, frames, params),
+                on_position=status.set_queue_position,
+                cost=estimate.seconds if estimate is not None else None,
+            )
+            self.observe_request(started, result)
+        except QueueFullError as e:
+            dprint.warn(f"Rejected model from {who}: {e}")
+            Metrics.requests_total.inc(result='busy')
+            await self.outbox.send_message(who, "I'm busy right now, please try again later.", priority=RESULT)
+        finally:
+            await status.delete()
+
+    @staticmethod
+    def observe_request(started: float, result: str):
+        Metrics.requests_total.inc(result=result)
+        Metrics.request_seconds.observe(time.perf_counter() - started, result=result)
+
+    async def process_model(self, msg, file_name, frames, params) -> str:
+        """Returns the outcome: 'cached', 'rendered' or 'failed'"""
+        who = msg.peer_id
+        document_id = msg.media.document.id
+
+        full_file_name = await self.download_model(msg, file_name)
+
+        with Metrics.stage_seconds.time(stage='hash'):
+            content_hash = await asyncio.to_thread(RenderCache.file_hash, full_file_name)
+        key = RenderCache.make_key(content_hash, params)
+        cached = await asyncio.to_thread(self.render_cache.get, key)
+        Metrics.cache_total.inc(cache='render', result='hit' if cached is not None else 'miss')
+        if cached is not None:
+            await asyncio.to_thread(self.render_cache.link_document, document_id, params, key)
+            try:
+                if await self.send_cached(who, cached, frames):
+                    return 'cached'
+            except Exception as e:
+                dprint.error(f"Failed to send cached file: {e}")
+
+        rendering = self.rendering.get(key)
+        if rendering is not None:
+            # The same model of another request is being rendered: one render, its video goes to both
+            dprint(f"Render of {key} is in progress, waiting for it")
+            res = await asyncio.shield(rendering)
+            return await self.deliver(who, res, key, document_id, params, frames)
+
+        rendering = self.rendering[key] = asyncio.get_running_loop().create_future()
+        res = None
+        try:
+            preview_task = None
+            if self.client.config.preview_size:
+                # Mesh and decimated mesh are cached by the preview job, the video job reuses them
+                preview = await self.render_preview(full_file_name, frames)
+                if preview is not None:
+                    # Sent while the video is rendered: its upload and turn in the outbox don't delay the video
+                    preview_task = asyncio.create_task(self.send_preview(who, preview))
+                    self.tasks.add(preview_task)
+                    preview_task.add_done_callback(self.tasks.discard)
+
+            delivery = {
+                'chat_id': utils.get_peer_id(who),
+                'key': key,
+                'document_id': document_id,
+                'params': params,
+                'frames': frames,
+            }
+            res = await self.convert(full_file_name, frames, self.render_cache.video_filename(key), delivery)
+        finally:
+            # Waiting requests get None if the render failed or was cancelled
+            del self.rendering[key]
+            rendering.set_result(res)
+        return await self.deliver(who, res, key, document_id, params, frames, preview_task, delivery.get('job_id'))
+
+    async def deliver(self, who, res: RenderResult | None, key, document_id, params, frames,
+                      preview_task: asyncio.Task | None = None, job_id=None) -> str:
+        """
+        Sends the rendered video. Returns the outcome: 'rendered' or 'failed'.
+        preview_task - sending the preview, its message is replaced by the video.
+        job_id - of the job queue: marked delivered once the video is sent, otherwise the next start sends it
+        """
+        preview_msg = await preview_task if preview_task is not None else None
 
         # Check if conversion was successful before sending
-        if file_vis is None:
-            await self.client.send_message(who,
+        if res is None:
+            await self.outbox.send_message(who,
                                            "Sorry, I couldn't process your 3D model file. Please make sure "
-                                           "it's a valid OBJ or STL file.")
-            return
+                                           "it's a valid OBJ or STL file.", priority=RESULT)
+            return 'failed'
+
+        if res.video_filename is None:
+            # Worker couldn't save the video, sending it from memory
+            video = res.video
+        else:
+            video = res.video_filename
+            await asyncio.to_thread(self.render_cache.put, key, res.video_filename, res.volume_mm3)
+            await asyncio.to_thread(self.render_cache.link_document, document_id, params, key)
 
         try:
-            await self.client.send_file(who, file=file_vis)
+            with Metrics.stage_seconds.time(stage='upload'):
+                msg = await self.send_video(
+                    who, key, video, frames, preview_msg=preview_msg, caption=f"Volume: {res.volume_mm3:.2f} mm³")
+            await asyncio.to_thread(self.render_cache.remember_document, key, msg.document)
             dprint.success(f"Successfully sent visualization to {who}")
+            if job_id is not None:
+                await self.job_queue.delivered(job_id)
+            return 'rendered'
         except Exception as e:
             dprint.error(f"Failed to send file: {e}")
-            await self.client.send_message(who, "Sorry, there was an error sending the visualization.")
-
+            await self.outbox.send_message(who, "Sorry, there was an error sending the visualization.",
+                                           priority=RESULT)
+            return 'failed'
+
+    async def resume_deliveries(self):
+        """Videos of requests of the previous run of the bot, rendered by workers meanwhile"""
+        await self.client.started.wait()
+        # Jobs of this run are sent by their requests
+        pending = await asyncio.to_thread(self.job_queue.queue.undelivered, self.started_at)
+        if pending:
+            dprint(f"Resuming {len(pending)} requests of the previous run")
+        await asyncio.gather(*[self.resume_delivery(job_id, delivery) for job_id, delivery in pending])
+
+    async def resume_delivery(self, job_id, delivery: dict):
+        try:
+            res = await self.job_queue.wait(job_id)
+            result = await self.deliver(
+                delivery['chat_id'], res, delivery['key'], delivery['document_id'], delivery['params'],
+                delivery['frames'], job_id=job_id)
+            dprint(f"Resumed request of job {job_id}: {result}")
+        except Exception as e:
+            dprint.error(f"Failed to resume request of job {job_id}: {e}")
 
     @events.register(events.NewMessage(incoming=True, pattern='^/start$'))
     async def message_handler(self, event: telethon.events.NewMessage.Event):
@@ -123,7 +555,7 @@ class Logic:
                f"File: {file}")
 
         # await event.message.reply("Hello! I've accepted your message.")
-        await self.client.send_message(who, message="Thanks for awaking the worst evil in the world! MUHAHAHA!")
+        await self.outbox.send_message(who, message="Thanks for awaking the worst evil in the world! MUHAHAHA!")
 
         text_buttons = [
             [Button.text("Start Anon Chat", single_use=True)],
@@ -139,8 +571,8 @@ class Logic:
                 Button.inline("Set Nickname")
             ]
         ]
-        await self.client.send_message(who, message="Choose an action (text buttons):", buttons=text_buttons)
-        await self.client.send_message(who, message="Choose an action (inline buttons):", buttons=inline_buttons)
+        await self.outbox.send_message(who, message="Choose an action (text buttons):", buttons=text_buttons)
+        await self.outbox.send_message(who, message="Choose an action (inline buttons):", buttons=inline_buttons)
 
     @events.register(events.NewMessage(incoming=True, pattern='Start Anon Chat|Get Help|Set Nickname'))
     async def button_handler(self, event: telethon.events.NewMessage.Event):
@@ -148,15 +580,15 @@ class Logic:
         text = event.raw_text
 
         if text == "Start Anon Chat":
-            await self.client.send_message(who, "Starting anonymous chat... Please wait for a match.")
+            await self.outbox.send_message(who, "Starting anonymous chat... Please wait for a match.")
         elif text == "Get Help":
             help_text = """Available commands:
             /start - Start the bot
             /help - Show this help message
             /stop - Stop current action"""
-            await self.client.send_message(who, help_text)
+            await self.outbox.send_message(who, help_text)
         elif text == "Set Nickname":
-            await self.client.send_message(who, "Please enter your desired nickname:")
+            await self.outbox.send_message(who, "Please enter your desired nickname:")
 
     @events.register(events.CallbackQuery)
     async def inline_button_handler(self, event: telethon.events.CallbackQuery.Event):
@@ -164,14 +596,14 @@ class Logic:
         data = event.data.decode('utf-8')
 
         if data == "Start Anon Chat":
-            await event.respond("Starting anonymous chat... Please wait for a match.")
+            await self.outbox.respond(event, "Starting anonymous chat... Please wait for a match.")
         elif data == "Get Help":
             help_text = """Available commands:
             /start - Start the bot
             /help - Show this help message
             /stop - Stop current action"""
-            await event.respond(help_text)
+            await self.outbox.respond(event, help_text)
         elif data == "Set Nickname":
-            await event.respond("Please enter your desired nickname:")
+            await self.outbox.respond(event, "Please enter your desired nickname:")
         await event.answer()
 
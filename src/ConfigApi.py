@@ -1,4 +1,6 @@
 import json
+import os
+
 
 class ConfigApi:
     def __init__(self, filename):
@@ -11,4 +13,68 @@ class ConfigApi:
             self.api_key = data['api']['id']
             self.api_hash = data['api']['hash']
             self.phone = data['api']['phone']
-            self.bot_token = data['api']['bot_token']
\ No newline at end of file
+            self.bot_token = data['api']['bot_token']
+
+            render = data.get('render', {})
+            self.render_workers = render.get('workers', os.cpu_count() or 1)
+            self.encoder_fps = render.get('fps', 30)
+            self.encoder_preset = render.get('encoder_preset', 'veryfast')
+            self.encoder_crf = render.get('encoder_crf', 23)
+            self.triangle_budget = render.get('triangle_budget', 300_000)
+            self.preview_size = render.get('preview_size', 384)  # 0 - no preview before the video
+            # Workers rendering one video at once, each its own segment of the orbit. 1 - a worker per video
+            self.split_workers = render.get('split_workers', 1)
+            # SQLite file of the job queue. If set - the bot only enqueues, `python -m src worker` renders
+            self.job_queue = render.get('job_queue', '')
+
+            download = data.get('download', {})
+            self.download_connections = download.get('connections', 4)
+            self.download_range_mb = download.get('range_mb', 8)
+            self.download_stream_parse = download.get('stream_parse', True)
+            # Bigger files are not parsed while downloading: the bot would hold ~1.2x of them in memory
+            self.download_stream_parse_max_mb = download.get('stream_parse_max_mb', 256)
+            # Downloads at once, each with its connections. Models over it wait for a turn
+            self.download_max_concurrent = download.get('max_concurrent', 8)
+
+            upload = data.get('upload', {})
+            self.upload_connections = upload.get('connections', 4)
+
+            send = data.get('send', {})
+            self.send_rate = send.get('rate', 25.0)  # Messages per second of the bot
+            self.send_chat_rate = send.get('chat_rate', 1.0)  # Messages per second of a chat
+            self.send_chat_burst = send.get('chat_burst', 3)
+            self.send_max_flood_wait = send.get('max_flood_wait', 300)  # Seconds, longer FloodWait fails the send
+
+            log = data.get('log', {})
+            self.log_filename = log.get('filename', 'bot_log.log')
+            self.log_max_mb = log.get('max_mb', 50)
+            self.log_backups = log.get('backups', 5)
+            self.log_json = log.get('json', False)
+
+            metrics = data.get('metrics', {})
+            self.metrics_host = metrics.get('host', '127.0.0.1')
+            self.metrics_port = metrics.get('port', 9108)  # 0 - disabled
+
+            limits = data.get('limits', {})
+            self.max_file_mb = limits.get('max_file_mb', 1024)
+            self.max_triangles = limits.get('max_triangles', 20_000_000)
+            self.max_memory_mb = limits.get('max_memory_mb', 4096)
+            # Downloads parsed at once: as many of the biggest streamed models as fit into the memory limit.
+            # Over it models are parsed by the render worker
+            self.download_stream_parse_max_concurrent = download.get(
+                'stream_parse_max_concurrent', max(1, self.max_memory_mb // self.download_stream_parse_max_mb))
+
+            queue = data.get('queue', {})
+            self.per_user_in_flight = queue.get('per_user_in_flight', 1)
+            self.max_queue = queue.get('max_queue', 50)
+            self.max_queue_per_user = queue.get('max_queue_per_user', 5)
+            if self.job_queue:
+                # Render workers are elsewhere and may be added any time: the job queue holds the backlog,
+                # the bot keeps only the fairness and admission limits
+                self.max_concurrent_jobs = queue.get('max_concurrent', 2 * self.max_queue)
+                self.heavy_concurrent_jobs = queue.get('heavy_concurrent', max(1, self.max_concurrent_jobs // 2))
+            else:
+                self.max_concurrent_jobs = queue.get('max_concurrent', self.render_workers)
+                self.heavy_concurrent_jobs = queue.get('heavy_concurrent', max(1, self.max_concurrent_jobs // 4))
+            self.heavy_job_seconds = queue.get('heavy_job_seconds', 60)
+            self.queue_aging = queue.get('aging', 1.0)
@@ -1,5 +1,7 @@
 import colorama
-from colorama import Fore, Style
+from colorama import Fore
+
+from .LogSink import sink, LogRecord, LogFilename
 
 from .Timer import now_local
 
@@ -14,7 +16,7 @@ class DPrintBase:
 
 
 class DPrint(DPrintBase):
-    log_filename = 'bot_log.log'
+    log_filename = LogFilename()
 
     def __init__(self, prefix='', is_without_repeats=False, base: DPrintBase | None = None):
         if base is not None:
@@ -35,14 +37,15 @@ class DPrint(DPrintBase):
 
         self.cache = txt
 
-        text = (
-                f'[{level}]' +
-                now_local().strftime('[%d/%m/%Y %H:%M:%S] ') +
-                f'{self.prefix} ' + txt
-        )
-        print(color + text + Style.RESET_ALL)
-        with open(DPrint.log_filename, 'a', encoding='UTF8') as f:
-            f.write(text + '\n')
+        time = now_local()
+        sink.put(LogRecord(
+            line=f'[{level}]' + time.strftime('[%d/%m/%Y %H:%M:%S] ') + f'{self.prefix} ' + txt,
+            color=color,
+            level=level,
+            prefix=self.prefix,
+            text=txt,
+            time=time,
+        ))
 
     def error(self, text):
         """
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import re
 from datetime import timedelta
@@ -5,9 +6,10 @@ from typing import *
 
 from telethon import TelegramClient
 from telethon.tl.custom import Message
-from tzlocal import get_localzone
 
 from src.DebugPrinter import DPrint
+from src.FileWriter import BackgroundFileWriter
+from src.Timer import local_zone
 
 
 # from DebugPrinter import DPrint
@@ -38,8 +40,18 @@ class FileDownloaderFromMessage:
                  filename: str,
                  day_border_local_hour: int,
                  dprint: DPrint,
-                 download_callback: Callable[[int, int], Awaitable[None]] = None
+                 download_callback: Callable[[int, int], Awaitable[None]] = None,
+                 connections: int = 1,
+                 range_size: int = 8 << 20,
+                 request_size: int = 512 << 10,
+                 on_data: Callable[[int, bytes], None] | None = None,
                  ):
+        """
+        connections > 1 - files bigger than range_size are downloaded by byte ranges concurrently.
+        range_size must be a multiple of request_size (which is at most 512 KB for Telegram).
+        on_data(offset, data) - consumer of the file while it is downloaded, called in the writer thread
+        with every written piece (in any order) and with the pieces downloaded before, when resuming
+        """
         self.client = client
         self.msg: Message = msg
         self.day_border_local_hour = day_border_local_hour
@@ -49,10 +61,16 @@ class FileDownloaderFromMessage:
         self.filename = filename
         self.filename_full = None
         self.filename_full_stub = None
+        self.filename_full_ranges = None
         self.stub_extension = '.stub'
+        self.ranges_extension = '.ranges'
+        self.connections = connections
+        self.request_size = request_size
+        self.range_size = range_size - range_size % request_size
+        self.on_data = on_data
 
     def calc_order_date(self):
-        msg_date = self.msg.date.astimezone(get_localzone())
+        msg_date = self.msg.date.astimezone(local_zone())
         order_date = msg_date if msg_date.hour < self.day_border_local_hour else (msg_date + timedelta(days=1))
 
         year = order_date.year
@@ -74,10 +92,13 @@ class FileDownloaderFromMessage:
 
         full_date, year, month, day = self.calc_order_date()
 
-        path_full = os.path.join(os.getcwd(), f"DATA/{year}/{full_date.strftime('%B')}/{day:02d}{month:02d}/{internal_customer_profile}")
-        os.makedirs(path_full, exist_ok=True)
+        def make_path():
+            path_full = os.path.join(os.getcwd(), f"DATA/{year}/{full_date.strftime('%B')}/{day:02d}{month:02d}/{internal_customer_profile}")
+            os.makedirs(path_full, exist_ok=True)
+            return path_full
 
-        return path_full
+        # Storage may be slow or remote - not on the event loop
+        return await asyncio.to_thread(make_path)
 
     async def cache_full_filenames(self):
         if self.path_full is None:
@@ -85,55 +106,180 @@ class FileDownloaderFromMessage:
 
         self.filename_full = self.path_full + self.filename
         self.filename_full_stub = os.path.abspath(self.path_full + self.filename + self.stub_extension)
+        self.filename_full_ranges = self.filename_full_stub + self.ranges_extension
+
+    @property
+    def is_parallel(self):
+        if os.path.exists(self.filename_full_ranges):
+            # Continue the way it was started
+            return True
+        return self.connections > 1 and self.msg.file.size > self.range_size
+
+    @property
+    def ranges_count(self):
+        return (self.msg.file.size + self.range_size - 1) // self.range_size
+
+    def read_done_ranges(self) -> set[int] | None:
+        """Indices of downloaded ranges, None if the stub is not downloaded by ranges"""
+        try:
+            with open(self.filename_full_ranges, 'r') as f:
+                return {int(line) for line in f if line.strip()}
+        except OSError:
+            return None
 
     def is_stub_fully_downloaded(self):
+        done_ranges = self.read_done_ranges()
+        if done_ranges is not None:
+            return len(done_ranges) == self.ranges_count
         try:
             return self.msg.file.size == os.path.getsize(self.filename_full_stub)
         except OSError:
             return False
 
+    def get_stub_size(self):
+        try:
+            return os.path.getsize(self.filename_full_stub)
+        except OSError:
+            return 0
+
+    def replay_stub(self, spans: Iterable[tuple[int, int]], chunk_size=4 << 20):
+        """Feeds on_data with the bytes downloaded before. Blocking - run it in a thread"""
+        if self.on_data is None:
+            return
+        with open(self.filename_full_stub, 'rb') as f:
+            for start, end in spans:
+                f.seek(start)
+                while start < end:
+                    data = f.read(min(chunk_size, end - start))
+                    if not data:
+                        break
+                    self.on_data(start, data)
+                    start += len(data)
+
     async def download_file_by_parts(self):
-        if self.is_stub_fully_downloaded():
+        received_bytes = await asyncio.to_thread(self.get_stub_size)
+        if received_bytes:
+            await asyncio.to_thread(self.replay_stub, [(0, received_bytes)])
+
+        if await asyncio.to_thread(self.is_stub_fully_downloaded):
             return
 
-        file = self.filename_full_stub
-        received_bytes = 0
         total_bytes = self.msg.file.size
 
+        writer = await BackgroundFileWriter(self.filename_full_stub, on_write=self.on_data).start()
         try:
-            received_bytes = os.path.getsize(file)
-        except OSError:
-            pass
+            async for chunk in self.client.iter_download(self.msg.media, offset=received_bytes):
+                await writer.write(received_bytes, chunk)
+                received_bytes += len(chunk)
+                if self.download_callback is not None:
+                    await self.download_callback(received_bytes, total_bytes)
+        except Exception as e:
+            self.dprint.error(f'An error occurred: {e}')
+            raise
+        finally:
+            await writer.close()
 
-        if os.path.exists(self.filename_full):
-            return
+    def prepare_ranges(self) -> set[int]:
+        """Returns indices of ranges already downloaded"""
+        done_ranges = self.read_done_ranges()
+
+        if done_ranges is None:
+            # Stub of a sequential download: its prefix is already here
+            received_bytes = self.get_stub_size()
+            done_ranges = {i for i in range(self.ranges_count)
+                           if min((i + 1) * self.range_size, self.msg.file.size) <= received_bytes}
+            with open(self.filename_full_ranges, 'w') as f:
+                f.writelines(f'{i}\n' for i in sorted(done_ranges))
+
+        return done_ranges
+
+    async def download_range(self, index: int, writer: BackgroundFileWriter, ranges_file, progress: list[int]):
+        offset = index * self.range_size
+        async for chunk in self.client.iter_download(
+                self.msg.media,
+                offset=offset,
+                limit=self.range_size // self.request_size,
+                request_size=self.request_size,
+                file_size=self.msg.file.size,
+        ):
+            await writer.write(offset, chunk)
+            offset += len(chunk)
+            progress[0] += len(chunk)
+            if self.download_callback is not None:
+                await self.download_callback(progress[0], self.msg.file.size)
+
+        def mark_done():
+            ranges_file.write(f'{index}\n')
+            ranges_file.flush()
+
+        # Range is marked done by the writer thread, after all its bytes are written
+        await writer.call(mark_done)
 
+    async def download_file_by_ranges(self):
+        done_ranges = await asyncio.to_thread(self.prepare_ranges)
+        if done_ranges:
+            spans = [(i * self.range_size, min((i + 1) * self.range_size, self.msg.file.size))
+                     for i in sorted(done_ranges)]
+            await asyncio.to_thread(self.replay_stub, spans)
+
+        pending = asyncio.Queue()
+        for index in range(self.ranges_count):
+            if index not in done_ranges:
+                pending.put_nowait(index)
+
+        progress = [sum(min(self.range_size, self.msg.file.size - i * self.range_size) for i in done_ranges)]
+        self.dprint(f'Downloading {pending.qsize()} ranges over {self.connections} connections')
+
+        ranges_file = await asyncio.to_thread(open, self.filename_full_ranges, 'a')
+        writer = await BackgroundFileWriter(
+            self.filename_full_stub,
+            preallocate_size=self.msg.file.size,
+            on_write=self.on_data,
+        ).start()
+
+        async def connection():
+            while not pending.empty():
+                await self.download_range(pending.get_nowait(), writer, ranges_file, progress)
+
+        tasks = [asyncio.create_task(connection()) for _ in range(min(self.connections, pending.qsize()))]
         try:
-            with open(file, 'ab') as file_parts:
-                async for chunk in self.client.iter_download(self.msg.media, offset=received_bytes):
-                    wrote = file_parts.write(chunk)
-                    received_bytes += wrote
-                    if self.download_callback is not None:
-                        await self.download_callback(received_bytes, total_bytes)
+            await asyncio.gather(*tasks)
         except Exception as e:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
             self.dprint.error(f'An error occurred: {e}')
             raise
+        finally:
+            await writer.close()
+            await asyncio.to_thread(ranges_file.close)
 
     def try_rename_completed_file(self):
+        """Blocking - run it in a thread"""
         if not os.path.exists(self.filename_full_stub) or not self.is_stub_fully_downloaded():
             return
 
+        # The only fsync: the file must be on the disk before it looks complete
+        with open(self.filename_full_stub, 'rb') as f:
+            os.fsync(f.fileno())
+
         rename_from = self.filename_full_stub
         rename_to = self.filename_full
         os.rename(rename_from, rename_to)
 
+        if os.path.exists(self.filename_full_ranges):
+            os.unlink(self.filename_full_ranges)
+
     async def init(self):
         await self.cache_full_filenames()
 
     async def run(self) -> str:
-        if not os.path.exists(self.filename_full):
-            await self.download_file_by_parts()
-            self.try_rename_completed_file()
+        if not await asyncio.to_thread(os.path.exists, self.filename_full):
+            if await asyncio.to_thread(lambda: self.is_parallel):
+                await self.download_file_by_ranges()
+            else:
+                await self.download_file_by_parts()
+            await asyncio.to_thread(self.try_rename_completed_file)
         else:
             self.dprint.rare(f'Already downloaded')
 
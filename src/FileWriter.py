@@ -0,0 +1,121 @@
+import asyncio
+import os
+import queue
+import threading
+from typing import *
+
+_STOP = object()
+
+
+class BackgroundFileWriter:
+    """
+    Writes pieces of a file in a dedicated thread, so the event loop never waits for the disk.
+    Fed through a bounded queue: a slow disk slows down the producer instead of eating RAM.
+    Contiguous pieces are coalesced into big writes.
+    Calls queued with call() run in the thread after all writes queued before them.
+    on_write(offset, data) is called in the thread after every write, it must not raise
+    """
+
+    def __init__(self,
+                 filename: str,
+                 preallocate_size: int | None = None,
+                 max_queued: int = 64,
+                 coalesce_size: int = 4 << 20,
+                 on_write: Callable[[int, bytes], None] | None = None):
+        self.filename = filename
+        self.on_write = on_write
+        self.preallocate_size = preallocate_size
+        self.coalesce_size = coalesce_size
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.thread = threading.Thread(target=self._loop, name=f'writer {os.path.basename(filename)}', daemon=True)
+        self.error: BaseException | None = None
+        self.file = None
+
+    def _open(self):
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        self.file = os.fdopen(fd, 'r+b', buffering=0)
+
+        if self.preallocate_size is not None:
+            if hasattr(os, 'posix_fallocate'):
+                # Real blocks instead of a sparse file: no fragmentation and no ENOSPC in the middle
+                os.posix_fallocate(fd, 0, self.preallocate_size)
+            if os.fstat(fd).st_size != self.preallocate_size:
+                self.file.truncate(self.preallocate_size)
+
+    async def start(self):
+        await asyncio.to_thread(self._open)
+        self.thread.start()
+        return self
+
+    def _write(self, offset, parts):
+        data = parts[0] if len(parts) == 1 else b''.join(parts)
+        self.file.seek(offset)
+        self.file.write(data)
+        if self.on_write is not None:
+            self.on_write(offset, data)
+
+    def _loop(self):
+        pending = None
+        while True:
+            item = pending if pending is not None else self.queue.get()
+            pending = None
+
+            if item is _STOP:
+                return
+            if self.error is not None:
+                # Drain the queue, so producers don't block forever
+                continue
+
+            try:
+                if callable(item):
+                    item()
+                    continue
+
+                offset, data = item
+                parts = [data]
+                end = offset + len(data)
+                size = len(data)
+                while size < self.coalesce_size:
+                    try:
+                        pending = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if pending is _STOP or callable(pending) or pending[0] != end:
+                        break
+                    parts.append(pending[1])
+                    end += len(pending[1])
+                    size += len(pending[1])
+                    pending = None
+
+                self._write(offset, parts)
+            except BaseException as e:
+                self.error = e
+
+    async def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            await asyncio.to_thread(self.queue.put, item)
+
+    async def write(self, offset: int, data: bytes):
+        if self.error is not None:
+            raise self.error
+        await self._put((offset, data))
+
+    async def call(self, func: Callable[[], Any]):
+        if self.error is not None:
+            raise self.error
+        await self._put(func)
+
+    def _fsync(self):
+        os.fsync(self.file.fileno())
+
+    async def close(self, fsync=False):
+        """Waits for all queued writes. fsync - flush to the disk before closing"""
+        if fsync:
+            await self._put(self._fsync)
+        await self._put(_STOP)
+        await asyncio.to_thread(self.thread.join)
+        await asyncio.to_thread(self.file.close)
+        if self.error is not None:
+            raise self.error
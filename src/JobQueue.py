@@ -0,0 +1,253 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, fields
+
+from .DebugPrinter import DPrint
+from .Visualisator.Encoder import EncoderSettings
+from .Visualisator.RenderPool import RenderJob, RenderResult
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,                 -- 'preview' or 'video'
+    priority INTEGER NOT NULL,          -- Lower goes first
+    job TEXT NOT NULL,                  -- RenderJob, JSON
+    delivery TEXT,                      -- Where the frontend sends the video, JSON
+    state TEXT NOT NULL,                -- queued, running, done, failed, cancelled
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,                        -- RenderResult without bytes, JSON
+    preview BLOB,
+    video BLOB,
+    error TEXT,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, priority, id);
+"""
+
+
+def job_to_json(job: RenderJob) -> str:
+    # Parts of split jobs live in one host only
+    data = asdict(job)
+    for name in ('frame_indices', 'frame_ring', 'shared_mesh'):
+        data.pop(name)
+    return json.dumps(data)
+
+
+def job_from_json(text: str) -> RenderJob:
+    data = json.loads(text)
+    data['encoder'] = EncoderSettings(**data['encoder'])
+    data['window_size'] = tuple(data['window_size'])
+    return RenderJob(**data)
+
+
+def result_to_json(result: RenderResult) -> str:
+    return json.dumps({f.name: getattr(result, f.name) for f in fields(RenderResult)
+                       if f.name not in ('video', 'preview', 'shared_mesh')})
+
+
+def result_from_json(text: str, preview: bytes | None, video: bytes | None) -> RenderResult:
+    return RenderResult(**json.loads(text), preview=preview, video=video)
+
+
+@dataclass
+class QueuedJob:
+    id: int
+    job: RenderJob
+
+
+class JobQueue:
+    """
+    Durable render job queue in SQLite, shared by the bot frontend and render workers of this host
+    or of other hosts with the same storage (the file system must support locks, paths must be the same).
+    Workers claim jobs with a lease and extend it while rendering: jobs of a lost worker
+    are claimed again, at most max_attempts times. Blocking - call it in a thread
+    """
+
+    def __init__(self, filename: str, max_attempts: int = 3):
+        self.filename = filename
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        # Connection per call: calls come from different threads and processes
+        db = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def transaction(self):
+        with self.connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+
+    def enqueue(self, job: RenderJob, priority: int = 0, delivery: dict | None = None) -> int:
+        now = time.time()
+        with self.connect() as db:
+            cursor = db.execute(
+                'INSERT INTO jobs (kind, priority, job, delivery, state, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ('preview' if job.preview_size is not None else 'video', priority, job_to_json(job),
+                 json.dumps(delivery) if delivery is not None else None, 'queued', now, now))
+            return cursor.lastrowid
+
+    def claim(self, worker: str, lease: float) -> QueuedJob | None:
+        """The next job for the worker, or None if there is nothing to do"""
+        now = time.time()
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE jobs SET state = 'failed', error = 'Workers were lost', updated = ? "
+                "WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts))
+            row = db.execute(
+                "SELECT id, job FROM jobs WHERE state = 'queued' OR (state = 'running' AND lease_until < ?) "
+                "ORDER BY priority, id LIMIT 1",
+                (now,)).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? "
+                "WHERE id = ?",
+                (worker, now + lease, now, row[0]))
+        return QueuedJob(row[0], job_from_json(row[1]))
+
+    def extend_lease(self, job_id: int, worker: str, lease: float) -> bool:
+        """False if the job is not of the worker anymore"""
+        with self.connect() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (time.time() + lease, job_id, worker))
+            return cursor.rowcount > 0
+
+    def release(self, job_id: int, worker: str):
+        """The worker stops: the job goes back to the queue, the attempt doesn't count"""
+        with self.connect() as db:
+            db.execute(
+                "UPDATE jobs SET state = 'queued', worker = NULL, attempts = attempts - 1, updated = ? "
+                "WHERE id = ? AND worker = ? AND state = 'running'",
+                (time.time(), job_id, worker))
+
+    def complete(self, job_id: int, result: RenderResult):
+        # A late result of a lost lease is as good as any
+        with self.connect() as db:
+            db.execute(
+                "UPDATE jobs SET state = 'done', result = ?, preview = ?, video = ?, updated = ? "
+                "WHERE id = ? AND state IN ('queued', 'running')",
+                (result_to_json(result), result.preview, result.video, time.time(), job_id))
+
+    def fail(self, job_id: int, error: str):
+        with self.connect() as db:
+            db.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, updated = ? WHERE id = ? AND state IN ('queued', 'running')",
+                (error, time.time(), job_id))
+
+    def cancel(self, job_id: int):
+        with self.connect() as db:
+            db.execute(
+                "UPDATE jobs SET state = 'cancelled', updated = ? WHERE id = ? AND state IN ('queued', 'running')",
+                (time.time(), job_id))
+
+    def status(self, job_id: int) -> tuple[str, RenderResult | None]:
+        """State of the job and its result when it is done"""
+        with self.connect() as db:
+            row = db.execute('SELECT state, result, preview, video FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return 'cancelled', None
+        state, result, preview, video = row
+        return state, result_from_json(result, preview, video) if state == 'done' else None
+
+    def mark_delivered(self, job_id: int):
+        with self.connect() as db:
+            db.execute('UPDATE jobs SET delivered = 1 WHERE id = ?', (job_id,))
+
+    def undelivered(self, created_before: float) -> list[tuple[int, dict]]:
+        """Videos whose frontend went away before they were sent: id and delivery"""
+        with self.connect() as db:
+            rows = db.execute(
+                "SELECT id, delivery FROM jobs WHERE delivered = 0 AND delivery IS NOT NULL "
+                "AND state IN ('queued', 'running', 'done') AND created < ? ORDER BY id",
+                (created_before,)).fetchall()
+        return [(job_id, json.loads(delivery)) for job_id, delivery in rows]
+
+    def prune(self, max_age: float = 24 * 3600):
+        """Forget finished jobs older than max_age seconds, delivered or not"""
+        with self.connect() as db:
+            db.execute(
+                "DELETE FROM jobs WHERE updated < ? AND state IN ('done', 'failed', 'cancelled')",
+                (time.time() - max_age,))
+
+    def counts(self) -> dict[str, int]:
+        with self.connect() as db:
+            return dict(db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+
+class QueuedRenderer:
+    """
+    Frontend side of the job queue: the same submit() as RenderPool, but jobs are rendered by workers,
+    started by `python -m src worker`. The result is polled
+    """
+
+    def __init__(self, queue: JobQueue, dprint: DPrint, poll_seconds: float = 0.5, timeout: float = 3600.0):
+        self.queue = queue
+        self.poll_seconds = poll_seconds
+        self.timeout = timeout  # Seconds, e.g. when no worker is running
+        self.dprint = DPrint('JOB QUEUE', base=dprint)
+
+    async def warm_up(self):
+        await asyncio.to_thread(self.queue.prune)
+        counts = await asyncio.to_thread(self.queue.counts)
+        self.dprint(f'Rendering by workers, jobs: {counts or "none"}')
+
+    async def submit(self, job: RenderJob, delivery: dict | None = None) -> RenderResult | None:
+        """
+        delivery - kept with a video job, so a restarted frontend still sends it until delivered(job_id).
+        The id of the job is added to it as 'job_id'
+        """
+        # Workers of other hosts see the same files by the same absolute paths
+        job.full_filename = os.path.abspath(job.full_filename)
+        if job.output_filename is not None:
+            job.output_filename = os.path.abspath(job.output_filename)
+        priority = 0 if job.preview_size is not None else 1
+        job_id = await asyncio.to_thread(self.queue.enqueue, job, priority, delivery)
+        if delivery is not None:
+            delivery['job_id'] = job_id
+        return await self.wait(job_id)
+
+    async def wait(self, job_id: int) -> RenderResult | None:
+        started = time.monotonic()
+        while True:
+            state, result = await asyncio.to_thread(self.queue.status, job_id)
+            if state == 'done':
+                return result if result.ok else None
+            if state in ('failed', 'cancelled'):
+                self.dprint.error(f'Job {job_id} {state}')
+                return None
+            if time.monotonic() - started > self.timeout:
+                self.dprint.error(f'Job {job_id} is not done in {self.timeout:.0f} s, cancelled')
+                await asyncio.to_thread(self.queue.cancel, job_id)
+                return None
+            await asyncio.sleep(self.poll_seconds)
+
+    async def delivered(self, job_id: int):
+        """The video is sent: a restarted frontend doesn't send it again"""
+        await asyncio.to_thread(self.queue.mark_delivered, job_id)
+
+    def shutdown(self):
+        pass
@@ -0,0 +1,271 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import *
+
+from .DebugPrinter import DPrint
+from .Metrics import stage_seconds
+
+
+class QueueFullError(Exception):
+    pass
+
+
+@dataclass
+class ScheduledJob:
+    user_id: int
+    run: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    on_position: Callable[[int], Awaitable[None]] | None = None
+    cost: float | None = None  # Estimated seconds of work
+    round: int = 0  # Round-robin round of the job among the users of its lane
+    position: int | None = field(default=None, compare=False)
+    submitted: float = field(default_factory=time.monotonic, compare=False)
+
+
+@dataclass
+class LaneStats:
+    name: str
+    concurrency: int
+    running: int
+    queued: int
+    started: int
+    finished: int
+    wait_p50: float
+    wait_max: float
+
+
+class Lane:
+    """Jobs of similar size with their own concurrency"""
+
+    def __init__(self, name: str, concurrency: int, max_cost: float | None):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_cost = max_cost  # None - no upper bound
+        # Order of keys is the order for jobs of equal round and priority: served user goes to the end
+        self.queues: OrderedDict[int, deque[ScheduledJob]] = OrderedDict()
+        self.round = 0  # Round of the last started job
+        self.user_rounds: dict[int, int] = {}  # Round of the last queued job of every user, if not behind
+        self.running = 0
+        self.started = 0
+        self.finished = 0
+        self.waits: deque[float] = deque(maxlen=200)  # Recent waiting times, seconds
+
+    @property
+    def queued(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def accepts(self, cost: float | None):
+        return self.max_cost is None or (cost is not None and cost <= self.max_cost)
+
+    def stats(self) -> LaneStats:
+        waits = sorted(self.waits)
+        return LaneStats(
+            name=self.name,
+            concurrency=self.concurrency,
+            running=self.running,
+            queued=self.queued,
+            started=self.started,
+            finished=self.finished,
+            wait_p50=waits[len(waits) // 2] if waits else 0.0,
+            wait_max=waits[-1] if waits else 0.0,
+        )
+
+
+class JobScheduler:
+    """
+    Admission control and order of jobs between Telegram handlers and rendering.
+    - jobs are routed by their estimated cost into the fast and the heavy lane, each with its own concurrency,
+      so small models are not stuck behind huge ones. Jobs of unknown cost are heavy.
+      At most `concurrency` jobs run in both lanes together: when there are not enough slots for the lanes
+      to have their own, they share them and a free slot goes to the lane whose next job has the lower priority cost
+    - in a lane users take turns: every job gets the next round of its user, but not earlier than the round
+      being started now, and earlier rounds go first. So a user with many jobs doesn't hold back the others
+    - in a round the cheapest job goes first (shortest job first). Waiting lowers the priority cost
+      by `aging` seconds per second
+    - at most `per_user_in_flight` running jobs of one user, jobs of one user - in order
+    - at most `max_queue` waiting jobs (`max_queue_per_user` of one user), above it QueueFullError is raised
+    """
+
+    def __init__(self,
+                 concurrency: int,
+                 per_user_in_flight: int,
+                 max_queue: int,
+                 max_queue_per_user: int,
+                 dprint: DPrint,
+                 heavy_concurrency: int = 1,
+                 heavy_cost: float = 60.0,
+                 aging: float = 1.0):
+        self.per_user_in_flight = per_user_in_flight
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.heavy_cost = heavy_cost
+        self.aging = aging
+        self.concurrency = max(1, concurrency)
+        self.dprint = DPrint('SCHEDULER', base=dprint)
+
+        heavy_concurrency = max(1, min(heavy_concurrency, self.concurrency))
+        self.lanes = [
+            Lane('fast', max(1, self.concurrency - heavy_concurrency), max_cost=heavy_cost),
+            Lane('heavy', heavy_concurrency, max_cost=None),
+        ]
+        self.in_flight: dict[int, int] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    @property
+    def queued(self):
+        return sum(lane.queued for lane in self.lanes)
+
+    @property
+    def running(self):
+        return sum(lane.running for lane in self.lanes)
+
+    def user_queued(self, user_id):
+        return sum(len(lane.queues.get(user_id, ())) for lane in self.lanes)
+
+    def stats(self) -> list[LaneStats]:
+        return [lane.stats() for lane in self.lanes]
+
+    def lane_for(self, cost: float | None) -> Lane:
+        return next(lane for lane in self.lanes if lane.accepts(cost))
+
+    async def submit(self,
+                     user_id: int,
+                     run: Callable[[], Awaitable[Any]],
+                     on_position: Callable[[int], Awaitable[None]] | None = None,
+                     cost: float | None = None):
+        """
+        Waits for a turn, runs the job and returns its result.
+        on_position(n) is called with the place in the lane queue (1 - next) while waiting, and with 0 when the job starts.
+        cost - estimated seconds of work, if known
+        """
+        if self.queued >= self.max_queue or self.user_queued(user_id) >= self.max_queue_per_user:
+            raise QueueFullError(f'Queue is full: {self.queued} jobs waiting')
+
+        job = ScheduledJob(user_id, run, asyncio.get_running_loop().create_future(), on_position, cost)
+        lane = self.lane_for(cost)
+        job.round = max(lane.round, lane.user_rounds.get(user_id, lane.round - 1) + 1)
+        lane.user_rounds[user_id] = job.round
+        lane.queues.setdefault(user_id, deque()).append(job)
+
+        self._dispatch()
+        return await job.future
+
+    def _can_start(self, user_id, in_flight):
+        return in_flight.get(user_id, 0) < self.per_user_in_flight
+
+    def _priority(self, job: ScheduledJob, now: float):
+        # Unknown cost is taken as the smallest heavy one
+        cost = job.cost if job.cost is not None else self.heavy_cost
+        return job.round, cost - self.aging * (now - job.submitted)
+
+    def _pick(self, lane: Lane, heads: dict[int, int], in_flight: dict[int, int], now: float) -> int | None:
+        """User whose next job starts first. heads - index of the next job of every user"""
+        best_user, best_priority = None, None
+        for user_id, queue in lane.queues.items():
+            index = heads.get(user_id, 0)
+            if index >= len(queue) or not self._can_start(user_id, in_flight):
+                continue
+            priority = self._priority(queue[index], now)
+            if best_priority is None or priority < best_priority:
+                best_user, best_priority = user_id, priority
+        return best_user
+
+    def _next(self, now: float) -> tuple[Lane, int] | None:
+        """Lane and user of the job to start now"""
+        best, best_priority = None, None
+        for lane in self.lanes:
+            if lane.running >= lane.concurrency:
+                continue
+            user_id = self._pick(lane, {}, self.in_flight, now)
+            if user_id is None:
+                continue
+            # Rounds of different lanes are not comparable, only costs are
+            _, priority = self._priority(lane.queues[user_id][0], now)
+            if best_priority is None or priority < best_priority:
+                best, best_priority = (lane, user_id), priority
+        return best
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self.running < self.concurrency:
+            picked = self._next(now)
+            if picked is None:
+                break
+            lane, user_id = picked
+            queue = lane.queues.pop(user_id)
+            job = queue.popleft()
+            if queue:
+                # Back to the end of the round
+                lane.queues[user_id] = queue
+            if job.round > lane.round:
+                lane.round = job.round
+                # Users behind the round get the current one anyway
+                lane.user_rounds = {user: r for user, r in lane.user_rounds.items() if r >= lane.round}
+
+            if job.future.done():
+                # Submitter is gone (cancelled)
+                continue
+
+            lane.running += 1
+            lane.started += 1
+            lane.waits.append(now - job.submitted)
+            stage_seconds.observe(now - job.submitted, stage='queue_wait')
+            self.in_flight[user_id] = self.in_flight.get(user_id, 0) + 1
+            task = asyncio.create_task(self._run(lane, job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        self._report_positions(now)
+
+    def _waiting_order(self, lane: Lane, now: float) -> list[ScheduledJob]:
+        """Waiting jobs of a lane in the order they are going to start (per-user caps aside)"""
+        order = []
+        heads: dict[int, int] = {}
+        while True:
+            user_id = self._pick(lane, heads, {}, now)
+            if user_id is None:
+                return order
+            order.append(lane.queues[user_id][heads.get(user_id, 0)])
+            heads[user_id] = heads.get(user_id, 0) + 1
+
+    def _report_positions(self, now: float):
+        for lane in self.lanes:
+            for position, job in enumerate(self._waiting_order(lane, now), start=1):
+                if job.position != position:
+                    job.position = position
+                    self._notify(job, position)
+
+    def _notify(self, job: ScheduledJob, position: int):
+        if job.on_position is None:
+            return
+        task = asyncio.create_task(self._safe_notify(job, position))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _safe_notify(self, job: ScheduledJob, position: int):
+        try:
+            await job.on_position(position)
+        except Exception as e:
+            self.dprint.warn(f'Failed to report queue position to {job.user_id}: {e}')
+
+    async def _run(self, lane: Lane, job: ScheduledJob):
+        self._notify(job, 0)
+        try:
+            result = await job.run()
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            lane.running -= 1
+            lane.finished += 1
+            self.in_flight[job.user_id] -= 1
+            if not self.in_flight[job.user_id]:
+                del self.in_flight[job.user_id]
+            self._dispatch()
+            self.dprint(' | '.join(
+                f'{s.name}: {s.running}/{s.concurrency} running, {s.queued} queued, wait p50 {s.wait_p50:.1f} s'
+                for s in self.stats()))
@@ -0,0 +1,209 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+from dataclasses import dataclass, asdict
+from datetime import datetime
+
+from colorama import Style
+
+from .FileLock import file_lock
+
+# Spawned worker processes take the settings of the main one from the environment
+ENV_SETTINGS = 'BOT_LOG_SETTINGS'
+
+_STOP = object()
+
+
+@dataclass
+class LogSettings:
+    filename: str = 'bot_log.log'
+    max_bytes: int = 50 << 20
+    backups: int = 5
+    is_json: bool = False
+
+    @classmethod
+    def from_config(cls, config) -> 'LogSettings':
+        """config - ConfigApi"""
+        return cls(
+            filename=config.log_filename,
+            max_bytes=config.log_max_mb << 20,
+            backups=config.log_backups,
+            is_json=config.log_json,
+        )
+
+
+@dataclass
+class LogRecord:
+    line: str  # Formatted text line
+    color: str
+    level: str
+    prefix: str
+    text: str
+    time: datetime | None = None
+
+    def to_json(self):
+        return json.dumps({
+            'time': self.time.isoformat() if self.time is not None else None,
+            'level': self.level,
+            'prefix': self.prefix,
+            'text': self.text,
+            'pid': os.getpid(),
+        }, ensure_ascii=False)
+
+
+class LogSink:
+    """
+    One background thread prints and writes all log records: callers only put them into a queue.
+    Records are written by batches with one write and flush, the file is kept open.
+    The file is rotated by size by any process writing it (the bot, render workers, the CLIs) under a lock file,
+    others reopen it when it is replaced
+    """
+    max_batch = 1000
+
+    def __init__(self, settings: LogSettings | None = None):
+        self.settings = settings or self.settings_from_env()
+        self.configured = self.settings  # The latest settings, the thread may still write with the previous ones
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.file = None
+
+    @staticmethod
+    def settings_from_env() -> LogSettings:
+        try:
+            return LogSettings(**json.loads(os.environ[ENV_SETTINGS]))
+        except (KeyError, ValueError, TypeError):
+            return LogSettings()
+
+    @property
+    def filename(self):
+        return self.configured.filename
+
+    def configure(self, settings: LogSettings):
+        """Records put before are written with the old settings"""
+        os.environ[ENV_SETTINGS] = json.dumps(asdict(settings))
+        self.configured = settings
+        self._put(settings)
+
+    def put(self, record: LogRecord):
+        self._put(record)
+
+    def _put(self, item):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._loop, name='log sink', daemon=True)
+                    self.thread.start()
+                    atexit.register(self.close)
+        self.queue.put(item)
+
+    def close(self, timeout=5.0):
+        """Writes everything queued"""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def _loop(self):
+        while True:
+            records = []
+            item = self.queue.get()
+            while True:
+                if isinstance(item, LogRecord):
+                    records.append(item)
+                else:
+                    self._write(records)
+                    records = []
+                    if item is _STOP:
+                        self._close_file()
+                        return
+                    self._close_file()
+                    self.settings = item
+
+                if len(records) >= self.max_batch:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            self._write(records)
+
+    def _write(self, records: list[LogRecord]):
+        if not records:
+            return
+
+        try:
+            sys.stdout.write(''.join(f'{r.color}{r.line}{Style.RESET_ALL}\n' for r in records))
+            sys.stdout.flush()
+        except (OSError, ValueError):
+            pass
+
+        if self.settings.is_json:
+            data = ''.join(r.to_json() + '\n' for r in records)
+        else:
+            data = ''.join(r.line + '\n' for r in records)
+
+        try:
+            self._open_file()
+            self.file.write(data)
+            self.file.flush()
+            if self.file.tell() >= self.settings.max_bytes:
+                self._rotate()
+        except OSError as e:
+            self._close_file()
+            print(f'Failed to write the log: {e}', file=sys.stderr)
+
+    def _open_file(self):
+        if self.file is not None:
+            try:
+                if os.stat(self.settings.filename).st_ino == os.fstat(self.file.fileno()).st_ino:
+                    return
+            except OSError:
+                pass
+            # Rotated or removed by someone else
+            self._close_file()
+
+        self.file = open(self.settings.filename, 'a', encoding='UTF8')
+
+    def _close_file(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+
+    def _rotate(self):
+        """bot_log.log -> bot_log.log.1 -> ... -> bot_log.log.<backups>"""
+        self._close_file()
+        filename = self.settings.filename
+        with file_lock(filename + '.lock'):
+            try:
+                if os.stat(filename).st_size < self.settings.max_bytes:
+                    # Already rotated by another process
+                    return
+            except FileNotFoundError:
+                return
+
+            if self.settings.backups <= 0:
+                os.unlink(filename)
+                return
+
+            for i in range(self.settings.backups - 1, 0, -1):
+                if os.path.exists(f'{filename}.{i}'):
+                    os.replace(f'{filename}.{i}', f'{filename}.{i + 1}')
+            os.replace(filename, f'{filename}.1')
+
+
+sink = LogSink()
+
+
+class LogFilename:
+    """DPrint.log_filename: the file of the log sink"""
+
+    def __get__(self, instance, owner):
+        return sink.filename
@@ -0,0 +1,202 @@
+import asyncio
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import *
+
+from .DebugPrinter import DPrint
+
+# Seconds, from a frame to a huge scan
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300, 600)
+COUNT_BUCKETS = tuple(10 ** i for i in range(2, 9))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...], extra: str = '') -> str:
+    items = [f'{name}="{_escape(value)}"' for name, value in labels]
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels: dict) -> tuple[tuple[str, str], ...]:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        for key, value in values:
+            yield f'{self.name}{_format_labels(key)} {_format_value(value)}'
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = TIME_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.values: dict[tuple, list] = {}  # key -> [bucket counts, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = [(key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items()]
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f'{self.name}_bucket{_format_labels(key, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(key)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(key)} {count}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+        self.collectors: list[Callable[[], None]] = []  # Update gauges right before a scrape
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            collect()
+        return ''.join(metric.render() for metric in self.metrics)
+
+
+registry = Registry()
+
+stage_seconds = registry.add(Histogram(
+    'bot_stage_seconds', 'Duration of a stage of the model request pipeline'))
+frame_seconds = registry.add(Histogram(
+    'bot_frame_seconds', 'Duration of rendering one frame', (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)))
+request_seconds = registry.add(Histogram(
+    'bot_request_seconds', 'Time from a received model to the sent video'))
+model_triangles = registry.add(Histogram(
+    'bot_model_triangles', 'Triangles of received models', COUNT_BUCKETS))
+bytes_total = registry.add(Counter(
+    'bot_bytes_total', 'Bytes of downloaded models and uploaded videos'))
+cache_total = registry.add(Counter(
+    'bot_cache_total', 'Cache lookups by result'))
+requests_total = registry.add(Counter(
+    'bot_requests_total', 'Model requests by outcome'))
+queue_jobs = registry.add(Gauge(
+    'bot_queue_jobs', 'Jobs of a scheduler lane by state'))
+sends_total = registry.add(Counter(
+    'bot_sends_total', 'Outbound messages by priority and outcome'))
+
+
+class MetricsServer:
+    """Minimal HTTP endpoint with the metrics in Prometheus text format: GET /metrics"""
+
+    def __init__(self, host: str, port: int, dprint: DPrint, registry: Registry = registry):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.dprint = DPrint('METRICS', base=dprint)
+        self.server: asyncio.Server | None = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.dprint(f'Serving on http://{self.host}:{self.port}/metrics')
+        return self
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 10)
+            # Headers are not needed
+            while await asyncio.wait_for(reader.readline(), 10) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request.decode('latin-1').split()
+            path = parts[1].split('?')[0] if len(parts) > 1 else ''
+            if parts and parts[0] == 'GET' and path == '/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            self.dprint.warn(f'Bad request: {e}')
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
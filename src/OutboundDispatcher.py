@@ -0,0 +1,231 @@
+import asyncio
+import itertools
+from dataclasses import dataclass
+from datetime import timedelta as td
+from typing import *
+
+from telethon import errors, utils, TelegramClient
+
+from .DebugPrinter import DPrint
+from .Metrics import sends_total
+from .Timer import Timer
+
+# Priority of a send, lower goes first
+RESULT = 0  # What the user waits for: videos, previews, refusals
+REPLY = 1  # Answers to commands and buttons
+STATUS = 2  # Queue positions and other progress
+
+PRIORITY_NAMES = {RESULT: 'result', REPLY: 'reply', STATUS: 'status'}
+
+
+class TokenBucket:
+    """
+    `rate` sends per second on average, up to `burst` at once. The refill Timer counts the time of the next token.
+    FloodWait blocks the bucket for the time Telegram asks, with jitter
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.period = td(seconds=1 / rate)
+        self.refill = Timer(self.period).start()
+        self.flood_wait: Timer | None = None
+
+    def _update(self):
+        passed = self.refill.already_passed
+        new = passed // self.period
+        if new:
+            self.tokens = min(self.burst, self.tokens + new)
+            # The rest of the time counts towards the next token
+            self.refill.reset(passed - new * self.period if self.tokens < self.burst else td())
+
+    @property
+    def is_idle(self):
+        """Full and not blocked: the same as a new bucket"""
+        return self.wait_seconds() == 0 and self.tokens == self.burst
+
+    def wait_seconds(self) -> float:
+        """0 - a send is possible now"""
+        if self.flood_wait is not None:
+            if not self.flood_wait.is_expired():
+                return max(0.001, (self.flood_wait.actual_interval - self.flood_wait.already_passed).total_seconds())
+            self.flood_wait = None
+        self._update()
+        if self.tokens:
+            return 0.0
+        return max(0.001, (self.period - self.refill.already_passed).total_seconds())
+
+    def take(self):
+        if self.tokens == self.burst:
+            # Time of a full bucket doesn't count
+            self.refill.reset()
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        # Sends of many chats blocked at once don't come back at once
+        self.flood_wait = Timer(td(seconds=seconds), td(seconds=seconds * 1.1)).start()
+        self.tokens = 0
+
+
+@dataclass
+class OutboundSend:
+    chat_id: int
+    priority: int
+    send: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    order: int
+    key: Hashable | None = None
+
+
+class OutboundDispatcher:
+    """
+    Every message of the bot goes through it, so the bot sends as fast as Telegram allows and no faster.
+    - sends are limited by a global and a per chat token bucket (Telegram: ~30 messages/s, ~1 per chat)
+    - results go before replies, replies before status messages
+    - one send of a chat at a time, sends of a chat of the same priority - in order
+    - status sends with the same key are coalesced: while one waits, a newer one takes its place
+    - FloodWait blocks the chat and the send is retried after it, up to `max_flood_wait` seconds.
+      Telethon sleeps short ones inside the request itself (flood_sleep_threshold)
+    """
+
+    def __init__(self,
+                 client: TelegramClient,
+                 dprint: DPrint,
+                 rate: float = 25.0,
+                 chat_rate: float = 1.0,
+                 chat_burst: int = 3,
+                 max_flood_wait: float = 300.0):
+        self.client = client
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_flood_wait = max_flood_wait
+        self.dprint = DPrint('OUTBOX', base=dprint)
+
+        self.bucket = TokenBucket(rate, max(1, int(rate)))
+        self.chat_buckets: dict[int, TokenBucket] = {}
+        self.pending: list[OutboundSend] = []
+        self.coalescing: dict[Hashable, OutboundSend] = {}
+        self.busy_chats: set[int] = set()
+        self.order = itertools.count()
+        self.wakeup: asyncio.TimerHandle | None = None
+        self.tasks: set[asyncio.Task] = set()
+
+    @property
+    def queued(self):
+        return len(self.pending)
+
+    async def send(self, who, send: Callable[[], Awaitable[Any]], priority: int = REPLY, key: Hashable | None = None):
+        """
+        Waits for a turn, makes the request by send() and returns its result.
+        key - coalesces sends: a newer send of a waiting key replaces it, its callers get the result of the newer one
+        """
+        chat_id = utils.get_peer_id(who)
+        if key is not None:
+            waiting = self.coalescing.get(key)
+            if waiting is not None and not waiting.future.done():
+                waiting.send = send
+                sends_total.inc(priority=PRIORITY_NAMES[priority], result='coalesced')
+                # A cancelled caller doesn't cancel the send of the other one
+                return await asyncio.shield(waiting.future)
+
+        request = OutboundSend(chat_id, priority, send, asyncio.get_running_loop().create_future(), next(self.order), key)
+        self.pending.append(request)
+        if key is not None:
+            self.coalescing[key] = request
+        self._dispatch()
+        return await request.future
+
+    async def send_message(self, who, *args, priority: int = REPLY, key: Hashable | None = None, **kwargs):
+        return await self.send(who, lambda: self.client.send_message(who, *args, **kwargs), priority, key)
+
+    async def send_file(self, who, *args, priority: int = RESULT, **kwargs):
+        return await self.send(who, lambda: self.client.send_file(who, *args, **kwargs), priority)
+
+    async def edit_message(self, msg, *args, priority: int = RESULT, **kwargs):
+        return await self.send(msg.chat_id, lambda: self.client.edit_message(msg, *args, **kwargs), priority)
+
+    async def respond(self, event, *args, priority: int = REPLY, **kwargs):
+        return await self.send(event.chat_id, lambda: event.respond(*args, **kwargs), priority)
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _dispatch(self):
+        if self.wakeup is not None:
+            self.wakeup.cancel()
+            self.wakeup = None
+
+        wait = None
+        for request in sorted(self.pending, key=lambda r: (r.priority, r.order)):
+            if request.future.done():
+                # Caller is gone (cancelled)
+                self._forget(request)
+                continue
+            if request.chat_id in self.busy_chats:
+                continue
+
+            seconds = self.bucket.wait_seconds()
+            if seconds:
+                # Nothing else can go either: the first to go when it is possible is the most important one
+                wait = seconds if wait is None else min(wait, seconds)
+                break
+            seconds = self.chat_bucket(request.chat_id).wait_seconds()
+            if seconds:
+                wait = seconds if wait is None else min(wait, seconds)
+                continue
+
+            self.bucket.take()
+            self.chat_bucket(request.chat_id).take()
+            self._forget(request)
+            self.busy_chats.add(request.chat_id)
+            task = asyncio.create_task(self._run(request))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        if wait is not None:
+            self.wakeup = asyncio.get_running_loop().call_later(wait, self._dispatch)
+
+    def _forget(self, request: OutboundSend):
+        self.pending.remove(request)
+        if request.key is not None and self.coalescing.get(request.key) is request:
+            del self.coalescing[request.key]
+
+    def _prune_chats(self):
+        if len(self.chat_buckets) < 1000:
+            return
+        for chat_id in [chat_id for chat_id, bucket in self.chat_buckets.items()
+                        if chat_id not in self.busy_chats and bucket.is_idle]:
+            del self.chat_buckets[chat_id]
+
+    async def _run(self, request: OutboundSend):
+        priority = PRIORITY_NAMES[request.priority]
+        try:
+            result = await request.send()
+            sends_total.inc(priority=priority, result='sent')
+            if not request.future.done():
+                request.future.set_result(result)
+        except (errors.FloodWaitError, errors.SlowModeWaitError) as e:
+            if e.seconds > self.max_flood_wait:
+                self.dprint.error(f'Chat {request.chat_id} is blocked for {e.seconds} s, the {priority} is dropped')
+                sends_total.inc(priority=priority, result='failed')
+                if not request.future.done():
+                    request.future.set_exception(e)
+            else:
+                self.dprint.warn(f'Chat {request.chat_id} is blocked for {e.seconds} s, the {priority} waits')
+                sends_total.inc(priority=priority, result='flood_wait')
+                self.chat_bucket(request.chat_id).block(e.seconds)
+                # The same turn: before newer sends of the chat
+                self.pending.append(request)
+                if request.key is not None:
+                    self.coalescing.setdefault(request.key, request)
+        except Exception as e:
+            sends_total.inc(priority=priority, result='failed')
+            if not request.future.done():
+                request.future.set_exception(e)
+        finally:
+            self.busy_chats.discard(request.chat_id)
+            self._prune_chats()
+            self._dispatch()
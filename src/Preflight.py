@@ -0,0 +1,176 @@
+from dataclasses import dataclass
+
+from telethon import TelegramClient
+from telethon.tl.custom import Message
+
+from .DebugPrinter import DPrint
+from .Downloader import get_extension
+
+STL_HEADER_SIZE = 84
+STL_RECORD_SIZE = 50
+
+
+class PreflightError(Exception):
+    """Model is refused before downloading. The message is shown to the user"""
+    pass
+
+
+@dataclass
+class CostEstimate:
+    triangles: int
+    is_exact: bool  # False - triangles are extrapolated from a sample
+    memory_bytes: int
+    seconds: float
+
+    def __str__(self):
+        approx = '' if self.is_exact else '~'
+        return f'{approx}{self.triangles} triangles, {self.memory_bytes >> 20} MB, {self.seconds:.1f} s'
+
+
+def count_stl_triangles(head: bytes, size: int) -> tuple[int, bool]:
+    """Triangles of an STL from the beginning of the file and its size"""
+    if size >= STL_HEADER_SIZE and len(head) >= STL_HEADER_SIZE:
+        count = int.from_bytes(head[80:84], 'little')
+        # Some binary files start with "solid" too, so size is the only reliable sign
+        if size == STL_HEADER_SIZE + count * STL_RECORD_SIZE:
+            return count, True
+
+    if not head.lstrip().startswith(b'solid'):
+        raise PreflightError('This is not a valid STL file.')
+    if b'\0' in head:
+        raise PreflightError('This STL file is damaged.')
+
+    is_whole = len(head) >= size
+    text = head if is_whole else head[:head.rfind(b'\n') + 1]
+    facets = text.count(b'endfacet')
+    if is_whole:
+        if not facets:
+            raise PreflightError('This STL file has no triangles.')
+        return facets, True
+    if not facets:
+        raise PreflightError('This STL file is not readable.')
+
+    # ASCII facets are of about the same length
+    return round(size * facets / len(text)), False
+
+
+def count_obj_triangles(head: bytes, size: int) -> tuple[int, bool]:
+    """Triangles of an OBJ, extrapolated from the density of vertices and faces in its beginning"""
+    if b'\0' in head:
+        raise PreflightError('This is not a valid OBJ file.')
+
+    is_whole = len(head) >= size
+    text = head if is_whole else head[:head.rfind(b'\n') + 1]
+
+    vertices = vertices_bytes = 0
+    triangles = faces = faces_bytes = 0
+    for line in text.splitlines(keepends=True):
+        words = line.split()
+        if not words:
+            continue
+        if words[0] == b'v':
+            vertices += 1
+            vertices_bytes += len(line)
+        elif words[0] == b'f':
+            faces += 1
+            faces_bytes += len(line)
+            triangles += max(1, len(words) - 3)
+
+    if is_whole:
+        if not triangles:
+            raise PreflightError('This OBJ file has no faces.')
+        return triangles, True
+
+    if not vertices and not faces:
+        # Only a long header in the sample - nothing to extrapolate from
+        raise PreflightError('This OBJ file is not readable.')
+
+    if not vertices:
+        return round(size * triangles / len(text)), False
+
+    # Vertices usually go first. A closed triangle mesh has about two faces per vertex
+    vertex_line = vertices_bytes / vertices
+    face_line = faces_bytes / faces if faces else vertex_line
+    triangles_per_face = triangles / faces if faces else 1
+    estimated_vertices = size / (vertex_line + 2 * face_line)
+    return round(2 * estimated_vertices * triangles_per_face), False
+
+
+class Preflight:
+    """
+    Checks a model before it is downloaded: size limit, first bytes of the file
+    and an estimate of render memory and time. Too big or malformed models raise PreflightError.
+    Speeds are measured on a server with software rendering, tune them for the hardware
+    """
+    head_size = 64 << 10  # Telegram serves parts aligned to 4 KB
+
+    base_memory = 400 << 20  # VTK and a plotter in the worker
+    memory_per_triangle = 300  # Parsing: file, vertices, keys, merge, PolyData
+    parse_triangles_per_second = 1.5e6
+    decimate_triangles_per_second = 1e5
+    frame_seconds = 0.3
+    frame_seconds_per_triangle = 4e-6
+
+    def __init__(self,
+                 client: TelegramClient,
+                 max_file_size: int,
+                 max_triangles: int,
+                 max_memory: int,
+                 triangle_budget: int | None,
+                 dprint: DPrint):
+        self.client = client
+        self.max_file_size = max_file_size
+        self.max_triangles = max_triangles
+        self.max_memory = max_memory
+        self.triangle_budget = triangle_budget
+        self.dprint = DPrint('PREFLIGHT', base=dprint)
+
+    async def fetch_head(self, msg: Message) -> bytes:
+        async for chunk in self.client.iter_download(
+                msg.media,
+                limit=1,
+                request_size=self.head_size,
+                file_size=msg.file.size,
+        ):
+            return bytes(chunk)
+        return b''
+
+    def estimate(self, triangles: int, is_exact: bool, frames: int) -> CostEstimate:
+        rendered = triangles
+        seconds = triangles / self.parse_triangles_per_second
+        if self.triangle_budget and triangles > self.triangle_budget:
+            rendered = self.triangle_budget
+            seconds += triangles / self.decimate_triangles_per_second
+        seconds += frames * (self.frame_seconds + rendered * self.frame_seconds_per_triangle)
+
+        return CostEstimate(
+            triangles=triangles,
+            is_exact=is_exact,
+            memory_bytes=self.base_memory + triangles * self.memory_per_triangle,
+            seconds=seconds,
+        )
+
+    async def check(self, msg: Message, file_name: str, frames: int) -> CostEstimate:
+        size = msg.file.size
+        if not size:
+            raise PreflightError('The file is empty.')
+        if size > self.max_file_size:
+            raise PreflightError(f'The file is too big, the limit is {self.max_file_size >> 20} MB.')
+
+        head = await self.fetch_head(msg)
+        extension = get_extension(file_name).lower()
+        if extension == 'stl':
+            triangles, is_exact = count_stl_triangles(head, size)
+        elif extension == 'obj':
+            triangles, is_exact = count_obj_triangles(head, size)
+        else:
+            raise PreflightError('Only OBJ and STL files are supported.')
+
+        estimate = self.estimate(triangles, is_exact, frames)
+        self.dprint(f'"{file_name}": {estimate}')
+
+        if triangles > self.max_triangles:
+            raise PreflightError(f'The model is too detailed, the limit is {self.max_triangles} triangles.')
+        if estimate.memory_bytes > self.max_memory:
+            raise PreflightError('The model is too big to render.')
+        return estimate
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+
+from telethon.tl.types import InputDocument
+
+from .DebugPrinter import DPrint
+from .FileLock import file_lock
+
+
+@dataclass
+class CachedRender:
+    key: str
+    video_filename: str
+    volume_mm3: float = 0.0
+    # Telegram handle of the first uploaded video: id, access_hash, file_reference (hex)
+    document: dict | None = None
+
+    @property
+    def input_document(self) -> InputDocument | None:
+        if self.document is None:
+            return None
+        return InputDocument(
+            id=self.document['id'],
+            access_hash=self.document['access_hash'],
+            file_reference=bytes.fromhex(self.document['file_reference']),
+        )
+
+    @property
+    def is_video_present(self):
+        return os.path.exists(self.video_filename)
+
+
+class RenderCache:
+    """
+    Persistent cache of finished renders.
+    Content-addressed: key = hash(file content hash, render parameters).
+    Telegram document ids are mapped to keys, so a known document is answered without downloading it again.
+    The index is shared with other processes (the bot, `python -m src render`): it is merged on every save
+    and re-read when it was changed by someone else.
+    Saving and re-reading block on the lock and the disk: the bot calls it in threads
+    """
+    index_filename = 'render_cache.json'
+
+    def __init__(self, directory: str, dprint: DPrint):
+        self.directory = directory
+        self.dprint = DPrint('RENDER CACHE', base=dprint)
+        self.renders: dict[str, CachedRender] = {}
+        self.documents: dict[str, str] = {}  # '<document id>:<params>' -> key
+        # Entries changed here since the last save, they win over the index on disk
+        self.changed_renders: set[str] = set()
+        self.changed_documents: set[str] = set()
+        self.index_mtime_ns = None
+        self.lock = threading.RLock()
+
+        self.load()
+
+    @property
+    def index_full_filename(self):
+        return os.path.join(self.directory, self.index_filename)
+
+    @staticmethod
+    def params_key(**params) -> str:
+        return json.dumps(params, sort_keys=True, default=str)
+
+    @staticmethod
+    def file_hash(filename, chunk_size=1 << 20) -> str:
+        """Blocking - run it in a thread for big files"""
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def make_key(content_hash: str, params: str) -> str:
+        return hashlib.sha256(f'{content_hash}:{params}'.encode()).hexdigest()[:32]
+
+    def video_filename(self, key, extension='.mp4'):
+        return os.path.join(self.directory, key + extension)
+
+    @contextmanager
+    def index_lock(self):
+        """Exclusive between processes and threads"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock, file_lock(self.index_full_filename + '.lock'):
+            yield
+
+    def _read(self) -> tuple[dict[str, CachedRender], dict[str, str]]:
+        """Index on disk. Empty if there is none"""
+        try:
+            self.index_mtime_ns = os.stat(self.index_full_filename).st_mtime_ns
+            with open(self.index_full_filename, 'r', encoding='UTF8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}, {}
+        renders = {key: CachedRender(**entry) for key, entry in data.get('renders', {}).items()}
+        return renders, data.get('documents', {})
+
+    def load(self):
+        try:
+            self.renders, self.documents = self._read()
+        except (OSError, ValueError, TypeError) as e:
+            self.dprint.warn(f'Index is unreadable, starting empty: {e}')
+            return
+        if self.renders:
+            self.dprint(f'Loaded {len(self.renders)} renders')
+
+    def refresh(self):
+        """Re-read the index if another process has saved it"""
+        try:
+            mtime_ns = os.stat(self.index_full_filename).st_mtime_ns
+        except OSError:
+            return
+        if mtime_ns == self.index_mtime_ns:
+            return
+        with self.index_lock():
+            self._merge()
+
+    def _merge(self):
+        """Index on disk with the changes of this process. Under the lock"""
+        try:
+            renders, documents = self._read()
+        except (OSError, ValueError, TypeError) as e:
+            self.dprint.warn(f'Index is unreadable, it is overwritten: {e}')
+            renders, documents = {}, {}
+        for key in self.changed_renders:
+            renders[key] = self.renders[key]
+        for document in self.changed_documents:
+            documents[document] = self.documents[document]
+        self.renders, self.documents = renders, documents
+
+    def save(self):
+        with self.index_lock():
+            self._merge()
+            data = {
+                'renders': {key: asdict(entry) for key, entry in self.renders.items()},
+                'documents': self.documents,
+            }
+            tmp_filename = self.index_full_filename + '.tmp'
+            with open(tmp_filename, 'w', encoding='UTF8') as f:
+                json.dump(data, f)
+            os.replace(tmp_filename, self.index_full_filename)
+            self.index_mtime_ns = os.stat(self.index_full_filename).st_mtime_ns
+            self.changed_renders.clear()
+            self.changed_documents.clear()
+
+    def _usable(self, entry: CachedRender | None):
+        if entry is None:
+            return None
+        if entry.document is None and not entry.is_video_present:
+            return None
+        return entry
+
+    def get_by_document(self, document_id: int, params: str) -> CachedRender | None:
+        document = f'{document_id}:{params}'
+        if document not in self.documents:
+            self.refresh()
+        return self._usable(self.renders.get(self.documents.get(document)))
+
+    def get(self, key: str) -> CachedRender | None:
+        if key not in self.renders:
+            self.refresh()
+        entry = self._usable(self.renders.get(key))
+        if entry is None and os.path.exists(self.video_filename(key)):
+            # Rendered by another process whose index entry is lost. Videos are renamed into place when finished
+            entry = self.put(key, self.video_filename(key), 0.0)
+        return entry
+
+    def link_document(self, document_id: int, params: str, key: str):
+        document = f'{document_id}:{params}'
+        with self.lock:
+            self.documents[document] = key
+            self.changed_documents.add(document)
+            self.save()
+
+    def put(self, key: str, video_filename: str, volume_mm3: float) -> CachedRender:
+        entry = CachedRender(key=key, video_filename=video_filename, volume_mm3=volume_mm3)
+        with self.lock:
+            self.renders[key] = entry
+            self.changed_renders.add(key)
+            self.save()
+            return self.renders[key]
+
+    def remember_document(self, key: str, document):
+        """Keep the handle of an uploaded video to re-send it without uploading"""
+        with self.lock:
+            entry = self.renders.get(key)
+            if entry is None or document is None:
+                return
+            entry.document = {
+                'id': document.id,
+                'access_hash': document.access_hash,
+                'file_reference': document.file_reference.hex(),
+            }
+            self.changed_renders.add(key)
+            self.save()
+
+    def forget_document(self, key: str):
+        with self.lock:
+            entry = self.renders.get(key)
+            if entry is not None and entry.document is not None:
+                entry.document = None
+                self.changed_renders.add(key)
+                self.save()
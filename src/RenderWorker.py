@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import os
+import signal
+import socket
+
+from .BatchRender import RenderSettings
+from .DebugPrinter import DPrint
+from .JobQueue import JobQueue, QueuedJob
+from .LogSink import sink
+from .Visualisator.RenderPool import RenderPool
+
+dprint = DPrint('WORKER')
+
+
+class RenderWorker:
+    """
+    Headless render service: claims jobs of the bot from the job queue, renders them on its own pool
+    and stores the results. Any number of them may run, on this host or on hosts sharing the storage
+    """
+    poll_seconds = 1.0
+
+    def __init__(self, queue: JobQueue, pool: RenderPool, split_workers: int = 1, lease: float = 60.0):
+        self.queue = queue
+        self.pool = pool
+        self.split_workers = split_workers
+        self.lease = lease  # Seconds. Extended while rendering, jobs of a lost worker are claimed again
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        # A split job takes several workers of the pool
+        self.capacity = self.pool.workers if split_workers <= 1 else max(1, self.pool.workers // (split_workers + 1))
+        self.running: dict[int, asyncio.Task] = {}
+        self.job_done = asyncio.Event()
+
+    async def run(self, stop: asyncio.Event):
+        await self.pool.warm_up()
+        dprint.success(f'{self.name} takes {self.capacity} jobs at once from "{self.queue.filename}"')
+        try:
+            while not stop.is_set():
+                while len(self.running) < self.capacity:
+                    claimed = await asyncio.to_thread(self.queue.claim, self.name, self.lease)
+                    if claimed is None:
+                        break
+                    self.running[claimed.id] = asyncio.create_task(self.process(claimed))
+
+                self.job_done.clear()
+                waiters = [asyncio.create_task(event.wait()) for event in (stop, self.job_done)]
+                await asyncio.wait(waiters, timeout=self.poll_seconds, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in waiters:
+                    waiter.cancel()
+        finally:
+            # Unfinished jobs go back to the queue at once, not after their lease
+            for job_id, task in list(self.running.items()):
+                task.cancel()
+                await asyncio.to_thread(self.queue.release, job_id, self.name)
+            await asyncio.gather(*self.running.values(), return_exceptions=True)
+            self.pool.shutdown()
+
+    async def keep_lease(self, job_id: int):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if not await asyncio.to_thread(self.queue.extend_lease, job_id, self.name, self.lease):
+                dprint.warn(f'Job {job_id} was taken by another worker')
+                return
+
+    async def process(self, claimed: QueuedJob):
+        job = claimed.job
+        dprint(f'Job {claimed.id}: {job.full_filename}')
+        lease = asyncio.create_task(self.keep_lease(claimed.id))
+        try:
+            if job.preview_size is None:
+                res = await self.pool.submit_split(job, self.split_workers)
+            else:
+                res = await self.pool.submit(job)
+
+            if res is None or not res.ok:
+                await asyncio.to_thread(self.queue.fail, claimed.id, 'Render failed')
+                dprint.error(f'Job {claimed.id} failed')
+            else:
+                await asyncio.to_thread(self.queue.complete, claimed.id, res)
+                dprint.success(f'Job {claimed.id} is done')
+        except Exception as e:
+            await asyncio.to_thread(self.queue.fail, claimed.id, str(e))
+            dprint.error(f'Job {claimed.id} failed: {e}')
+        finally:
+            lease.cancel()
+            self.running.pop(claimed.id, None)
+            self.job_done.set()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--queue', help='SQLite file of the job queue, default: render.job_queue of the config')
+    parser.add_argument('--config', default='./src/Config/config.json', help='Bot config with render parameters')
+    parser.add_argument('--workers', type=int, help='Render processes, default: from the config')
+    parser.add_argument('--split', type=int, help='Workers per video, default: from the config')
+    parser.add_argument('--lease', type=float, default=60.0, help='Seconds a lost worker keeps its jobs')
+
+
+async def main(args: argparse.Namespace) -> int:
+    settings = RenderSettings.from_config(args.config, frames=0)
+    sink.configure(settings.log)
+    filename = args.queue or settings.job_queue
+    if not filename:
+        dprint.error('No job queue: pass --queue or set render.job_queue in the config')
+        return 1
+
+    pool = RenderPool(args.workers if args.workers is not None else settings.workers, dprint, settings.encoder)
+    worker = RenderWorker(
+        JobQueue(filename),
+        pool,
+        split_workers=args.split if args.split is not None else settings.split_workers,
+        lease=args.lease,
+    )
+
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGINT, stop.set)
+    except (NotImplementedError, RuntimeError):
+        # Windows: Ctrl+C interrupts the loop instead
+        pass
+
+    await worker.run(stop)
+    dprint('Stopped')
+    return 0
@@ -1,11 +1,18 @@
 import random
 from datetime import timedelta as td, datetime
+from functools import lru_cache
 
 from tzlocal import get_localzone
 
 
+@lru_cache(maxsize=1)
+def local_zone():
+    """get_localzone() reads the system settings, the zone doesn't change while running"""
+    return get_localzone()
+
+
 def now_local():
-    datetime_kyiv = datetime.now(get_localzone())
+    datetime_kyiv = datetime.now(local_zone())
     return datetime_kyiv
 
 
@@ -55,7 +62,8 @@ class Timer:
         if check_interval_max is None:
             check_interval_max = check_interval_min
         self.interval_mid = (check_interval_min + check_interval_max) // 2
-        self.interval_variation_mcs = abs(check_interval_max.microseconds - check_interval_min.microseconds) // 2
+        # Whole difference, not only the microseconds component of it
+        self.interval_variation_mcs = abs(check_interval_max - check_interval_min) // td(microseconds=1) // 2
         self.actual_interval = self.generate_new_actual_interval()
 
         return self
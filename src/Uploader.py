@@ -0,0 +1,118 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from telethon import TelegramClient, helpers
+from telethon.tl import functions, types
+
+from .DebugPrinter import DPrint
+from .Metrics import bytes_total
+
+BIG_FILE_SIZE = 10 << 20  # Telegram wants SaveBigFilePart above it
+PART_SIZE = 512 << 10  # The biggest part Telegram accepts
+
+
+@dataclass
+class UploadedFile:
+    input_file: types.InputFile | types.InputFileBig
+    size: int
+    uploaded: float = field(default_factory=time.monotonic)
+
+
+class Uploader:
+    """
+    Uploads a file once per key (render hash): sends to other users and retries reference the same InputFile.
+    Parts are saved over `connections` concurrent requests, one upload of a key runs at a time.
+    Telegram keeps uploaded parts for a limited time, so handles older than max_age are uploaded again
+    """
+
+    def __init__(self, client: TelegramClient, dprint: DPrint, connections: int = 4, max_age: float = 3600.0):
+        self.client = client
+        self.connections = max(1, connections)
+        self.max_age = max_age
+        self.dprint = DPrint('UPLOADER', base=dprint)
+        self.files: dict[str, UploadedFile] = {}
+        self.uploading: dict[str, asyncio.Task] = {}
+
+    def get(self, key: str) -> types.InputFile | types.InputFileBig | None:
+        now = time.monotonic()
+        for expired in [k for k, uploaded in self.files.items() if now - uploaded.uploaded >= self.max_age]:
+            del self.files[expired]
+        uploaded = self.files.get(key)
+        return uploaded.input_file if uploaded is not None else None
+
+    def forget(self, key: str):
+        """Telegram refused the handle: the next upload() of the key uploads again"""
+        self.files.pop(key, None)
+
+    async def upload(self, key: str, file: str | bytes, file_name: str) -> types.InputFile | types.InputFileBig:
+        """file - filename or content"""
+        input_file = self.get(key)
+        if input_file is not None:
+            return input_file
+
+        task = self.uploading.get(key)
+        if task is None:
+            task = asyncio.create_task(self._upload(file, file_name))
+            self.uploading[key] = task
+            task.add_done_callback(lambda _: self.uploading.pop(key, None))
+        # A cancelled sender doesn't cancel the upload others wait for
+        uploaded = await asyncio.shield(task)
+        self.files[key] = uploaded
+        return uploaded.input_file
+
+    async def _upload(self, file: str | bytes, file_name: str) -> UploadedFile:
+        if isinstance(file, str):
+            def read():
+                with open(file, 'rb') as f:
+                    return f.read()
+
+            data = await asyncio.to_thread(read)
+        else:
+            data = bytes(file)
+
+        size = len(data)
+        if not size:
+            raise ValueError('Nothing to upload: the file is empty')
+
+        is_big = size > BIG_FILE_SIZE
+        parts_count = (size + PART_SIZE - 1) // PART_SIZE
+        file_id = helpers.generate_random_long()
+        view = memoryview(data)
+
+        pending = asyncio.Queue()
+        for index in range(parts_count):
+            pending.put_nowait(index)
+
+        async def connection():
+            while not pending.empty():
+                index = pending.get_nowait()
+                part = bytes(view[index * PART_SIZE:(index + 1) * PART_SIZE])
+                if is_big:
+                    request = functions.upload.SaveBigFilePartRequest(file_id, index, parts_count, part)
+                else:
+                    request = functions.upload.SaveFilePartRequest(file_id, index, part)
+                if not await self.client(request):
+                    raise RuntimeError(f'Telegram refused part {index} of "{file_name}"')
+
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(connection()) for _ in range(min(self.connections, parts_count))]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.dprint.error(f'Failed to upload "{file_name}": {e}')
+            raise
+
+        bytes_total.inc(size, direction='upload')
+        self.dprint(f'Uploaded "{file_name}": {size >> 10} KB in {parts_count} parts '
+                    f'over {len(tasks)} connections, {time.perf_counter() - start:.1f} s')
+
+        if is_big:
+            input_file = types.InputFileBig(file_id, parts_count, file_name)
+        else:
+            # md5 is optional
+            input_file = types.InputFile(file_id, parts_count, file_name, '')
+        return UploadedFile(input_file, size)
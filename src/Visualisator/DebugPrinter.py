@@ -1,5 +1,7 @@
 import colorama
-from colorama import Fore, Style
+from colorama import Fore
+
+from src.LogSink import sink, LogRecord, LogFilename
 
 colorama.init()
 
@@ -12,7 +14,7 @@ class DPrintBase:
 
 
 class DPrint(DPrintBase):
-    log_filename = 'bot_log.log'
+    log_filename = LogFilename()
 
     def __init__(self, prefix='', is_without_repeats=False, base: DPrintBase | None = None):
         if base is not None:
@@ -33,13 +35,13 @@ class DPrint(DPrintBase):
 
         self.cache = txt
 
-        text = (
-                f'[{level}]' +
-                f'{self.prefix} ' + txt
-        )
-        print(color + text + Style.RESET_ALL)
-        with open(DPrint.log_filename, 'a', encoding='UTF8') as f:
-            f.write(text + '\n')
+        sink.put(LogRecord(
+            line=f'[{level}]{self.prefix} ' + txt,
+            color=color,
+            level=level,
+            prefix=self.prefix,
+            text=txt,
+        ))
 
     def error(self, text):
         """
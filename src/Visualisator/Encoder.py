@@ -0,0 +1,166 @@
+import io
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import *
+
+import numpy as np
+
+from src.DebugPrinter import DPrint
+
+
+@dataclass(frozen=True)
+class EncoderSettings:
+    fps: int = 30
+    preset: str = 'veryfast'  # x264 preset: ultrafast ... veryslow. Faster - bigger file
+    crf: int = 23  # x264 quality: 0 (lossless) ... 51. Lower - better and bigger
+
+
+@dataclass(frozen=True)
+class EncoderBackend:
+    name: str
+    extension: str
+
+    def open(self, target, settings: EncoderSettings):
+        """target - filename or binary file-like object"""
+        # Only render workers encode, the bot process doesn't load imageio
+        import imageio
+
+        if self.name == 'libx264':
+            return imageio.get_writer(
+                target,
+                format='mp4',
+                fps=settings.fps,
+                codec='libx264',
+                quality=None,
+                pixelformat='yuv420p',
+                output_params=['-preset', settings.preset, '-crf', str(settings.crf)],
+            )
+        if self.name == 'mp4':
+            return imageio.get_writer(target, format='mp4', fps=settings.fps, quality=7, pixelformat='yuv420p')
+        if self.name == 'gif':
+            return imageio.get_writer(target, format='gif', duration=1 / settings.fps, loop=0)
+        raise ValueError(f'Unknown encoder backend: {self.name}')
+
+
+# In order of preference
+BACKENDS = (
+    EncoderBackend('libx264', '.mp4'),
+    EncoderBackend('mp4', '.mp4'),
+    EncoderBackend('gif', '.gif'),
+)
+
+
+def encode_still(frame: np.ndarray, quality: int = 85) -> bytes:
+    """One frame as JPEG"""
+    import imageio
+
+    target = io.BytesIO()
+    imageio.imwrite(target, frame, format='jpeg', quality=quality)
+    return target.getvalue()
+
+
+@dataclass
+class EncodedVideo:
+    target: io.BytesIO | str  # str - filename
+    encode_seconds: float
+    save_seconds: float
+
+
+def encode_video(frames: Iterable[np.ndarray], output_filename: str | None,
+                 settings: EncoderSettings, dprint: DPrint) -> EncodedVideo | None:
+    """
+    Encodes frames as they come. The extension of output_filename is the one of the backend,
+    if it is None - the video is kept in memory. None if there are no frames or no working encoder
+    """
+    frames = iter(frames)
+    first_frame = next(frames, None)
+    if first_frame is None:
+        dprint.error('No images captured')
+        return None
+
+    backend = probe_encoder(settings, dprint)
+    if backend is None:
+        dprint.error('No working video encoder')
+        return None
+
+    if output_filename is None:
+        target = io.BytesIO()
+        partial = target
+    else:
+        base = os.path.splitext(output_filename)[0]
+        target = base + backend.extension
+        # Readers of the target see a finished video or none: it is written under another name and renamed
+        partial = f'{base}.{os.getpid()}.partial{backend.extension}'
+
+    encode_seconds = 0.0
+    try:
+        writer = backend.open(partial, settings)
+        try:
+            start = time.perf_counter()
+            writer.append_data(first_frame)
+            encode_seconds += time.perf_counter() - start
+            del first_frame
+            for frame in frames:
+                start = time.perf_counter()
+                writer.append_data(frame)
+                encode_seconds += time.perf_counter() - start
+        finally:
+            # Flushing the encoder and finishing the file
+            start = time.perf_counter()
+            writer.close()
+            save_seconds = time.perf_counter() - start
+        if isinstance(partial, str):
+            os.replace(partial, target)
+    except BaseException:
+        if isinstance(partial, str):
+            try:
+                os.unlink(partial)
+            except OSError:
+                pass
+        raise
+
+    if isinstance(target, io.BytesIO):
+        target.seek(0)
+    return EncodedVideo(target, encode_seconds, save_seconds)
+
+
+# Settings -> the backend found for them, probed once per process
+_probed: dict[EncoderSettings, EncoderBackend | None] = {}
+
+
+def probe_encoder(settings: EncoderSettings, dprint: DPrint) -> EncoderBackend | None:
+    """
+    Finds the first backend able to encode a tiny clip.
+    Cached, so it is done once per process and every job encodes exactly once
+    """
+    if settings in _probed:
+        return _probed[settings]
+
+    _probed[settings] = _probe(settings, dprint)
+    return _probed[settings]
+
+
+def _probe(settings: EncoderSettings, dprint: DPrint) -> EncoderBackend | None:
+    frame = np.zeros((16, 16, 3), dtype=np.uint8)
+
+    for backend in BACKENDS:
+        fd, probe_filename = tempfile.mkstemp(suffix=backend.extension)
+        os.close(fd)
+        try:
+            writer = backend.open(probe_filename, settings)
+            writer.append_data(frame)
+            writer.append_data(frame)
+            writer.close()
+            if os.path.getsize(probe_filename) > 0:
+                return backend
+        except Exception as e:
+            dprint.warn(f'Encoder "{backend.name}" is unavailable: {e}')
+        finally:
+            try:
+                os.unlink(probe_filename)
+            except OSError:
+                pass
+
+    return None
@@ -1,7 +1,8 @@
 import pickle
+import time
 import traceback
 from concurrent.futures import ProcessPoolExecutor
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from io import BytesIO
 
 import pyvista
@@ -9,7 +10,10 @@ import vtkmodules.util.pickle_support  # For pickle vtkPolyData
 from vtkmodules.vtkCommonDataModel import vtkPolyData
 
 from src.DebugPrinter import DPrint
+from src.Visualisator.Encoder import EncoderSettings, encode_still
+from src.Visualisator.MeshCache import MeshCache, MeshStats
 from src.Visualisator.MeshBuilderVTK import MeshBuilderVTK
+from src.Visualisator.MeshLoaderNumpy import load_streamed_vertices
 from src.Visualisator.RenderPyVista import Visualizer
 
 
@@ -20,13 +24,13 @@ class ProcessedModel:
     image = None
 
 
-def build(full_filename):
+def build(full_filename, dprint: DPrint):
     """Build mesh from file"""
     try:
-        mesh: vtkPolyData = MeshBuilderVTK(full_filename).build_mesh()
+        mesh: vtkPolyData = MeshBuilderVTK(full_filename, dprint=dprint).build_mesh()
         return mesh
     except Exception as e:
-        print(f"Error building mesh: {e}")
+        dprint.error(f"Error building mesh: {e}")
         return None
 
 
@@ -34,7 +38,11 @@ def build(full_filename):
 class HandledModel:
     filename: str
     volume_mm3: float
-    image: None | BytesIO
+    image: None | BytesIO | str  # str - filename of the saved video
+    triangles: int = 0
+    is_mesh_cached: bool = False
+    timings: dict[str, float] = field(default_factory=dict)  # Stage -> seconds
+    frame_seconds: list[float] = field(default_factory=list)
 
 
 class HandlerModel:
@@ -43,6 +51,12 @@ class HandlerModel:
             full_filename: str,
             frames: int,
             dprint: DPrint,
+            encoder: EncoderSettings = EncoderSettings(),
+            output_filename: str | None = None,
+            plotter: pyvista.Plotter | None = None,
+            triangle_budget: int | None = None,
+            is_mesh_cache: bool = True,
+            window_size: tuple[int, int] = (1024, 1024),
     ):
         self.filename = full_filename.split('/')[-1]
         self.full_filename = full_filename
@@ -51,10 +65,31 @@ class HandlerModel:
         self.pyvista_mesh: pyvista.PolyData | None = None
         self.anim_frames = frames
         self.anim_angle = 360 / self.anim_frames
+        self.encoder = encoder
+        self.output_filename = output_filename
+        self.plotter = plotter
+        self.triangle_budget = triangle_budget  # Bigger meshes are decimated before rendering
+        self.window_size = window_size
+        self.mesh_cache = MeshCache(full_filename) if is_mesh_cache else None
+        self.stats: MeshStats | None = None
+        self.volume_mm3 = 0.0
+        self.triangles = 0
+        self.is_mesh_cached = False
         self.image = None
+        self.timings: dict[str, float] = {}
+        self.frame_seconds: list[float] = []
+
+    def set_mesh(self, mesh: pyvista.PolyData, volume_mm3: float, triangles: int):
+        """Mesh prepared by another process: it is rendered as is, nothing is built"""
+        self.pyvista_mesh = mesh
+        self.volume_mm3 = volume_mm3
+        self.triangles = triangles
 
     def _build(self):
         """Build mesh from file"""
+        if self.pyvista_mesh is not None:
+            return True
+
         try:
             self.dprint('Building mesh from file...')
 
@@ -64,7 +99,17 @@ class HandlerModel:
                 self.dprint.error(f'File does not exist: {self.full_filename}')
                 return False
 
-            vtk_mesh = build(self.full_filename)
+            start = time.perf_counter()
+            if self._load_cached():
+                self.timings['mesh_cache_load'] = time.perf_counter() - start
+                self._decimate()
+                return True
+
+            start = time.perf_counter()
+            vtk_mesh = self._build_streamed()
+            if vtk_mesh is None:
+                vtk_mesh = build(self.full_filename, self.dprint)
+            self.timings['build_mesh'] = time.perf_counter() - start
             if vtk_mesh is None:
                 self.dprint.error('Failed to build VTK mesh')
                 return False
@@ -79,8 +124,15 @@ class HandlerModel:
                 self.dprint.error('Mesh has no points')
                 return False
 
+            # Volume is always taken from the original mesh
+            self.volume_mm3 = self.pyvista_mesh.volume
+            self.triangles = self.pyvista_mesh.n_cells
+
             self.dprint.success(
-                f'Mesh built successfully. Points: {self.pyvista_mesh.n_points}, Volume: {self.pyvista_mesh.volume:.2f} mm³')
+                f'Mesh built successfully. Points: {self.pyvista_mesh.n_points}, Volume: {self.volume_mm3:.2f} mm³')
+
+            self._save_cached()
+            self._decimate()
             return True
 
         except Exception as e:
@@ -88,6 +140,96 @@ class HandlerModel:
             self.dprint.error(f'Traceback: {traceback.format_exc()}')
             return False
 
+    def _build_streamed(self) -> pyvista.PolyData | None:
+        """Mesh of vertices the bot parsed while downloading"""
+        if self.mesh_cache is None:
+            return None
+        streamed = self.mesh_cache.load_vertices()
+        if streamed is None:
+            return None
+        try:
+            mesh = load_streamed_vertices(*streamed)
+            self.dprint(f'Mesh merged from streamed vertices: {mesh.n_cells} triangles')
+            return mesh
+        except Exception as e:
+            self.dprint.warn(f'Failed to merge streamed vertices, parsing the file: {e}')
+            return None
+        finally:
+            del streamed
+
+    def _load_cached(self):
+        if self.mesh_cache is None:
+            return False
+
+        cached = self.mesh_cache.load()
+        if cached is None:
+            return False
+
+        self.pyvista_mesh, self.stats = cached
+        self.volume_mm3 = self.stats.volume_mm3
+        self.triangles = self.stats.n_cells
+        self.is_mesh_cached = True
+        self.dprint.success(
+            f'Mesh loaded from cache. Points: {self.stats.n_points}, Volume: {self.volume_mm3:.2f} mm³')
+        return True
+
+    def _save_cached(self):
+        if self.mesh_cache is None:
+            return
+
+        try:
+            self.stats = self.mesh_cache.save(self.pyvista_mesh, self.volume_mm3)
+            self.mesh_cache.remove_vertices()
+        except Exception as e:
+            self.dprint.warn(f'Failed to cache parsed mesh: {e}')
+
+    def _decimate(self):
+        """Reduce the mesh to the triangle budget. Output is 1024px anyway"""
+        if not self.triangle_budget:
+            return
+
+        triangles = self.pyvista_mesh.n_cells
+        if triangles <= self.triangle_budget:
+            return
+
+        start = time.perf_counter()
+        decimated_cache = None
+        if self.mesh_cache is not None:
+            # Decimated once, e.g. for the preview, and reused by the video job
+            decimated_cache = MeshCache(self.full_filename, variant=f'decimated_{self.triangle_budget}')
+            cached = decimated_cache.load()
+            if cached is not None:
+                self.pyvista_mesh = cached[0]
+                self.dprint(f'Decimated mesh loaded from cache: {cached[1].n_cells} triangles')
+                self.timings['decimate'] = time.perf_counter() - start
+                return
+
+        try:
+            mesh = self.pyvista_mesh.triangulate()
+            triangles = mesh.n_cells
+            if triangles <= self.triangle_budget:
+                self.pyvista_mesh = mesh
+                return
+
+            # Quadric decimation
+            decimated = mesh.decimate(1 - self.triangle_budget / triangles)
+            if decimated.n_points == 0:
+                self.dprint.warn('Decimation produced an empty mesh, rendering the original')
+                return
+
+            self.pyvista_mesh = decimated
+            self.dprint(f'Mesh decimated: {triangles} -> {decimated.n_cells} triangles')
+
+            if decimated_cache is not None:
+                try:
+                    decimated_cache.save(decimated, self.volume_mm3)
+                except Exception as e:
+                    self.dprint.warn(f'Failed to cache decimated mesh: {e}')
+        except Exception as e:
+            self.dprint.warn(f'Decimation failed, rendering the original: {e}')
+        finally:
+            self.timings['decimate'] = time.perf_counter() - start
+
     def _visualize(self):
         """Create visualization from mesh"""
         try:
@@ -100,10 +242,19 @@ class HandlerModel:
             visualizer = Visualizer(
                 poly_data=self.pyvista_mesh,
                 frames=self.anim_frames,
-                angle=self.anim_angle
+                angle=self.anim_angle,
+                window_size=self.window_size,
+                encoder=self.encoder,
+                output_filename=self.output_filename,
+                plotter=self.plotter,
+                dprint=self.dprint,
             )
 
             self.image = visualizer.gen_gif()
+            self.frame_seconds = visualizer.frame_seconds
+            self.timings['render_frames'] = sum(visualizer.frame_seconds)
+            self.timings['encode'] = visualizer.encode_seconds
+            self.timings['save'] = visualizer.save_seconds
 
             if self.image is None:
                 self.dprint.error('Visualization failed - no image generated')
@@ -117,6 +268,86 @@ class HandlerModel:
             self.dprint.error(f'Traceback: {traceback.format_exc()}')
             return False
 
+    def preview(self, window_size=(384, 384)):
+        """
+        Builds the mesh and renders one small JPEG still - a quick answer before the video.
+        Parsed and decimated meshes are cached, so the video job doesn't repeat the work
+        """
+        try:
+            self.dprint('Starting preview...')
+
+            if not self._build():
+                self.dprint.error('Failed to build mesh')
+                return None
+
+            start = time.perf_counter()
+            frame = Visualizer(
+                poly_data=self.pyvista_mesh,
+                frames=self.anim_frames,
+                angle=self.anim_angle,
+                plotter=self.plotter,
+                dprint=self.dprint,
+            ).render_still(window_size)
+            self.image = BytesIO(encode_still(frame))
+            self.timings['preview'] = time.perf_counter() - start
+
+            return HandledModel(
+                filename=self.full_filename,
+                volume_mm3=self.volume_mm3,
+                image=self.image,
+                triangles=self.triangles,
+                is_mesh_cached=self.is_mesh_cached,
+                timings=self.timings,
+            )
+
+        except Exception as e:
+            self.dprint.error(f'Error rendering preview: {str(e)}')
+            self.dprint.error(f'Traceback: {traceback.format_exc()}')
+            return None
+
+    def prepare(self):
+        """Only builds the mesh (parsed, cached and decimated) - for a job split between workers"""
+        if not self._build():
+            self.dprint.error('Failed to build mesh')
+            return None
+
+        return HandledModel(
+            filename=self.full_filename,
+            volume_mm3=self.volume_mm3,
+            image=None,
+            triangles=self.triangles,
+            is_mesh_cached=self.is_mesh_cached,
+            timings=self.timings,
+        )
+
+    def capture(self, frame_indices, on_frame):
+        """
+        Renders only the given frames, not encoded - a part of a job split between workers.
+        on_frame(index, frame) gets each one. Returns the number of rendered frames, None on failure
+        """
+        try:
+            if not self._build():
+                self.dprint.error('Failed to build mesh')
+                return None
+
+            visualizer = Visualizer(
+                poly_data=self.pyvista_mesh,
+                frames=self.anim_frames,
+                angle=self.anim_angle,
+                window_size=self.window_size,
+                plotter=self.plotter,
+                dprint=self.dprint,
+            )
+            visualizer.capture_frames(frame_indices, on_frame)
+            self.frame_seconds = visualizer.frame_seconds
+            self.timings['render_frames'] = sum(visualizer.frame_seconds)
+            return len(visualizer.frame_seconds)
+
+        except Exception as e:
+            self.dprint.error(f'Error rendering frames: {str(e)}')
+            self.dprint.error(f'Traceback: {traceback.format_exc()}')
+            return None
+
     def process(self):
         """Process the model file and create visualization"""
         try:
@@ -138,8 +369,12 @@ class HandlerModel:
 
             result = HandledModel(
                 filename=self.full_filename,
-                volume_mm3=self.pyvista_mesh.volume,
-                image=self.image
+                volume_mm3=self.volume_mm3,
+                image=self.image,
+                triangles=self.triangles,
+                is_mesh_cached=self.is_mesh_cached,
+                timings=self.timings,
+                frame_seconds=self.frame_seconds,
             )
 
             self.dprint.success('Model processing completed successfully')
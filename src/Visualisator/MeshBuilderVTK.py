@@ -1,14 +1,31 @@
 import vtk
 
+from src.DebugPrinter import DPrint
+from src.Visualisator.MeshLoaderNumpy import binary_stl_triangle_count, load_binary_stl
+
 
 class MeshBuilderVTK:
-    def __init__(self, model_full_filename):
+    def __init__(self, model_full_filename, is_fast_loader=True, dprint: DPrint | None = None):
         self.model_full_filename = model_full_filename
+        self.dprint = dprint if dprint is not None else DPrint('MESH BUILDER')
+        self.is_fast_loader = is_fast_loader
 
         ext = model_full_filename.split('.')[-1]
         self.mesh_reader = vtk.vtkSTLReader if ext == 'stl' else vtk.vtkOBJReader
 
     def build_mesh(self):
+        # Text formats stay on VTK readers: they are faster than bulk NumPy parsing (see benchmarks/bench_loader.py)
+        if self.is_fast_loader and self.mesh_reader is vtk.vtkSTLReader:
+            try:
+                count = binary_stl_triangle_count(self.model_full_filename)
+                if count is not None:
+                    return load_binary_stl(self.model_full_filename, count)
+            except Exception as e:
+                self.dprint.warn(f"Fast loader failed, falling back to {self.mesh_reader.__name__}: {e}")
+
+        return self.build_mesh_vtk()
+
+    def build_mesh_vtk(self):
         vtk.vtkAlgorithmOutput().SetGlobalWarningDisplay(False)
 
         reader = self.mesh_reader()
@@ -0,0 +1,136 @@
+import json
+import os
+from dataclasses import dataclass, asdict
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pyvista
+
+
+@dataclass
+class MeshStats:
+    volume_mm3: float
+    bounds: list[float]
+    n_points: int
+    n_cells: int
+    source_size: int
+    source_mtime_ns: int
+
+
+class MeshCache:
+    """
+    Parsed mesh saved next to its source as memory-mappable .npy arrays.
+    <model>.mesh/points.npy, faces.npy (VTK cells layout) and stats.json.
+    stats.json is written last, so a mesh without it is never used.
+    variant - a derived mesh (e.g. decimated) kept in <model>.mesh/<variant>/.
+    Vertices of a binary STL parsed while downloading wait in <model>.mesh/stream/ until a worker merges them
+    """
+    version = 1
+
+    def __init__(self, model_full_filename, variant: str | None = None):
+        self.model_full_filename = model_full_filename
+        self.directory = model_full_filename + '.mesh'
+        if variant is not None:
+            self.directory = os.path.join(self.directory, variant)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _source_signature(self):
+        st = os.stat(self.model_full_filename)
+        return st.st_size, st.st_mtime_ns
+
+    def load(self) -> tuple['pyvista.PolyData', MeshStats] | None:
+        """Mesh with zero parsing, or None if there is no valid cache"""
+        try:
+            with open(self._path('stats.json'), 'r', encoding='UTF8') as f:
+                data = json.load(f)
+            if data.pop('version', None) != self.version:
+                return None
+            stats = MeshStats(**data)
+            if (stats.source_size, stats.source_mtime_ns) != self._source_signature():
+                return None
+
+            points = np.load(self._path('points.npy'), mmap_mode='r')
+            faces = np.load(self._path('faces.npy'), mmap_mode='r')
+        except (OSError, ValueError, TypeError):
+            return None
+
+        import pyvista
+        return pyvista.PolyData(points, faces), stats
+
+    def save(self, mesh: 'pyvista.PolyData', volume_mm3: float) -> MeshStats | None:
+        faces = np.asarray(mesh.faces)
+        if not len(faces):
+            # Only polygons are kept
+            return None
+
+        source_size, source_mtime_ns = self._source_signature()
+        stats = MeshStats(
+            volume_mm3=float(volume_mm3),
+            bounds=[float(b) for b in mesh.bounds],
+            n_points=int(mesh.n_points),
+            n_cells=int(mesh.n_cells),
+            source_size=source_size,
+            source_mtime_ns=source_mtime_ns,
+        )
+
+        os.makedirs(self.directory, exist_ok=True)
+        stats_filename = self._path('stats.json')
+        if os.path.exists(stats_filename):
+            os.unlink(stats_filename)
+
+        np.save(self._path('points.npy'), np.ascontiguousarray(mesh.points))
+        np.save(self._path('faces.npy'), np.ascontiguousarray(faces))
+
+        tmp_filename = stats_filename + '.tmp'
+        with open(tmp_filename, 'w', encoding='UTF8') as f:
+            json.dump({'version': self.version, **asdict(stats)}, f)
+        os.replace(tmp_filename, stats_filename)
+        return stats
+
+    def _stream_path(self, name):
+        return os.path.join(self.directory, 'stream', name)
+
+    def save_vertices(self, vertices: np.ndarray, keys: np.ndarray):
+        """Unmerged vertices and their keys. No VTK: the bot process saves them, a render worker merges"""
+        os.makedirs(self._stream_path(''), exist_ok=True)
+        source_filename = self._stream_path('source.json')
+        if os.path.exists(source_filename):
+            os.unlink(source_filename)
+
+        np.save(self._stream_path('vertices.npy'), vertices)
+        np.save(self._stream_path('keys.npy'), keys)
+
+        source_size, source_mtime_ns = self._source_signature()
+        tmp_filename = source_filename + '.tmp'
+        with open(tmp_filename, 'w', encoding='UTF8') as f:
+            json.dump({'version': self.version, 'source_size': source_size, 'source_mtime_ns': source_mtime_ns}, f)
+        os.replace(tmp_filename, source_filename)
+
+    def load_vertices(self) -> tuple[np.ndarray, np.ndarray] | None:
+        """Memory-mapped vertices and keys, or None"""
+        try:
+            with open(self._stream_path('source.json'), 'r', encoding='UTF8') as f:
+                data = json.load(f)
+            if (data.get('version'), data.get('source_size'), data.get('source_mtime_ns')) != \
+                    (self.version, *self._source_signature()):
+                return None
+            return (np.load(self._stream_path('vertices.npy'), mmap_mode='r'),
+                    np.load(self._stream_path('keys.npy'), mmap_mode='r'))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def remove_vertices(self):
+        """The merged mesh is cached, the vertices are not needed anymore"""
+        for name in ('source.json', 'vertices.npy', 'keys.npy'):
+            try:
+                os.unlink(self._stream_path(name))
+            except OSError:
+                pass
+        try:
+            os.rmdir(self._stream_path(''))
+        except OSError:
+            pass
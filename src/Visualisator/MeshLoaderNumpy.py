@@ -0,0 +1,397 @@
+import os
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    # Imported where used: the bot process streams STL without loading VTK
+    import pyvista
+
+STL_HEADER_SIZE = 84
+STL_RECORD = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attribute', '<u2'),
+])  # 50 bytes
+
+CHUNK_SIZE = 32 << 20
+
+_SPACE = ord(' ')
+_NEWLINE = ord('\n')
+
+
+def iter_text_chunks(filename, chunk_size=CHUNK_SIZE):
+    """Reads a text file by big chunks, cut on line borders. Every chunk ends with a newline"""
+    with open(filename, 'rb') as f:
+        tail = b''
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = tail + data
+            cut = data.rfind(b'\n') + 1
+            if cut == 0:
+                tail = data
+                continue
+            tail = data[cut:]
+            yield data[:cut]
+        if tail:
+            yield tail + b'\n'
+
+
+def _is_space(text: np.ndarray) -> np.ndarray:
+    return (text == _SPACE) | (text == _NEWLINE) | (text == ord('\t')) | (text == ord('\r'))
+
+
+def _word_starts(is_space: np.ndarray) -> np.ndarray:
+    starts = ~is_space
+    starts[1:] &= is_space[:-1]
+    return np.flatnonzero(starts)
+
+
+def select_lines(chunk: bytes, keyword: bytes) -> tuple[np.ndarray, int]:
+    """
+    Bytes of all lines whose first word is `keyword`, with the keyword blanked out.
+    Whole chunk is processed with array operations, no per-line Python code.
+    Returns the text as uint8 array and the count of such lines
+    """
+    text = np.frombuffer(chunk, dtype=np.uint8)
+    is_space = _is_space(text)
+
+    newlines = np.flatnonzero(text == _NEWLINE)
+    line_starts = np.concatenate(([0], newlines[:-1] + 1))
+    line_ends = newlines + 1
+
+    # First word of every line
+    words = _word_starts(is_space)
+    first_word = np.searchsorted(words, line_starts)
+    has_word = first_word < len(words)
+    first = np.full(len(line_starts), len(text) - 1)
+    first[has_word] = words[first_word[has_word]]
+    has_word &= first < line_ends
+
+    matched = has_word
+    last = len(text) - 1
+    for i, char in enumerate(keyword):
+        matched &= text[np.minimum(first + i, last)] == char
+    matched &= is_space[np.minimum(first + len(keyword), last)]
+
+    count = int(matched.sum())
+    if not count:
+        return np.empty(0, dtype=np.uint8), 0
+
+    # Byte mask of the matched lines: +1 on line start, -1 after its end
+    delta = np.zeros(len(text) + 1, dtype=np.int8)
+    delta[line_starts[matched]] = 1
+    delta[line_ends[matched]] -= 1
+    selected = text[np.cumsum(delta[:-1], dtype=np.int8).view(bool)]
+
+    # Keyword is at a known offset of every selected line
+    selected_starts = np.concatenate(([0], np.cumsum(line_ends[matched] - line_starts[matched])[:-1]))
+    keyword_at = selected_starts + (first[matched] - line_starts[matched])
+    for i in range(len(keyword)):
+        selected[keyword_at + i] = _SPACE
+
+    return selected, count
+
+
+def count_words_per_line(text: np.ndarray) -> np.ndarray:
+    words = _word_starts(_is_space(text))
+    newlines = np.flatnonzero(text == _NEWLINE)
+    return np.diff(np.searchsorted(words, newlines), prepend=0)
+
+
+def parse_numbers(text: np.ndarray, dtype) -> np.ndarray:
+    values = np.fromstring(text.tobytes().decode('ascii'), dtype=dtype, sep=' ')
+    # fromstring silently stops on the first bad number
+    if values.size != len(_word_starts(_is_space(text))):
+        raise ValueError('Malformed numbers')
+    return values
+
+
+def parse_rows(text: np.ndarray, lines: int, columns: int, dtype) -> np.ndarray:
+    """First `columns` numbers of every line"""
+    values = parse_numbers(text, dtype)
+    if values.size == lines * columns:
+        return values.reshape(-1, columns)
+
+    # Extra numbers (w, vertex colors) are dropped
+    counts = count_words_per_line(text)
+    if (counts < columns).any():
+        raise ValueError(f'Less than {columns} numbers in a line')
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return values[starts[:, None] + np.arange(columns)]
+
+
+def normalize_vertices(vertices: np.ndarray) -> np.ndarray:
+    # +0.0 turns -0.0 into 0.0, so both are merged
+    return np.ascontiguousarray(vertices, dtype=np.float32) + np.float32(0.0)
+
+
+def vertex_keys(vertices: np.ndarray) -> np.ndarray:
+    """64-bit key of every normalized vertex: x and y exactly, z mixed in"""
+    bits = vertices.view(np.uint32).astype(np.uint64)
+    keys = (bits[:, 0] << np.uint64(32)) | bits[:, 1]
+    keys ^= bits[:, 2] * np.uint64(0x9E3779B97F4A7C15)
+    return keys
+
+
+def merge_vertices(vertices: np.ndarray, keys: np.ndarray | None = None):
+    """
+    vertices - (N, 3) float32 array of triangle corners.
+    keys - their vertex_keys() if already known, then vertices must be normalized.
+    Returns unique points and (N,) indices of corners into them
+    """
+    if keys is None:
+        vertices = normalize_vertices(vertices)
+        keys = vertex_keys(vertices)
+
+    # Sorting 64-bit keys is much faster than sorting 12-byte records
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    points = vertices[first]
+
+    if not np.array_equal(points[inverse], vertices):
+        # Key collision of different vertices - exact and slow way
+        records = vertices.view(np.dtype((np.void, 12))).ravel()
+        _, first, inverse = np.unique(records, return_index=True, return_inverse=True)
+        points = vertices[first]
+
+    return points, inverse.ravel()
+
+
+def make_polydata(points: np.ndarray, triangles: np.ndarray) -> 'pyvista.PolyData':
+    """triangles - (M, 3) indices of points"""
+    import pyvista
+
+    faces = np.empty((len(triangles), 4), dtype=np.int64)
+    faces[:, 0] = 3
+    faces[:, 1:] = triangles
+    return pyvista.PolyData(points, faces.ravel())
+
+
+def binary_stl_triangle_count(filename):
+    """Triangle count if the file is a binary STL, None otherwise"""
+    size = os.path.getsize(filename)
+    if size < STL_HEADER_SIZE:
+        return None
+    with open(filename, 'rb') as f:
+        header = f.read(STL_HEADER_SIZE)
+    count = int(np.frombuffer(header, dtype='<u4', count=1, offset=80)[0])
+    # Some binary files start with "solid" too, so size is the only reliable sign
+    return count if size == STL_HEADER_SIZE + count * STL_RECORD.itemsize else None
+
+
+def load_binary_stl(filename, count):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    records = np.frombuffer(data, dtype=STL_RECORD, count=count, offset=STL_HEADER_SIZE)
+    points, indices = merge_vertices(records['vertices'].reshape(-1, 3))
+    return make_polydata(points, indices.reshape(-1, 3))
+
+
+class BinaryStlStream:
+    """
+    Parses a binary STL from pieces while it is downloaded, in any order.
+    Triangle count follows from the file size, so arrays are allocated before the header arrives.
+    Records cut by piece borders are collected until complete.
+    Vertex keys are computed on the fly, only merging is left for finish().
+    Never raises from feed(): a file that is not a binary STL just makes the stream invalid
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.received = 0
+        self.header = bytearray(STL_HEADER_SIZE)
+        self.header_received = 0
+        self.partial: dict[int, list] = {}  # record index -> [bytearray, received bytes]
+        self.error: str | None = None
+
+        count, rest = divmod(size - STL_HEADER_SIZE, STL_RECORD.itemsize)
+        if size < STL_HEADER_SIZE or rest:
+            self.error = 'Size is not of a binary STL'
+            return
+        self.count = count
+        self.vertices = np.empty((count * 3, 3), dtype=np.float32)
+        self.keys = np.empty(count * 3, dtype=np.uint64)
+
+    @property
+    def is_valid(self):
+        return self.error is None
+
+    @property
+    def is_complete(self):
+        return self.is_valid and self.received == self.size
+
+    def _store(self, first_record: int, data):
+        records = np.frombuffer(data, dtype=STL_RECORD)
+        vertices = normalize_vertices(records['vertices'].reshape(-1, 3))
+        start, end = first_record * 3, (first_record + len(records)) * 3
+        self.vertices[start:end] = vertices
+        self.keys[start:end] = vertex_keys(vertices)
+
+    def _feed_header(self, offset: int, data):
+        end = min(len(data), STL_HEADER_SIZE - offset)
+        self.header[offset:offset + end] = data[:end]
+        self.header_received += end
+        if self.header_received == STL_HEADER_SIZE:
+            count = int(np.frombuffer(self.header, dtype='<u4', count=1, offset=80)[0])
+            if count != self.count:
+                self.error = 'Triangle count in the header does not match the size'
+
+    def _feed_partial(self, index: int, offset: int, data):
+        """Part of one record, offset - inside the record"""
+        buffer = self.partial.setdefault(index, [bytearray(STL_RECORD.itemsize), 0])
+        buffer[0][offset:offset + len(data)] = data
+        buffer[1] += len(data)
+        if buffer[1] == STL_RECORD.itemsize:
+            del self.partial[index]
+            self._store(index, buffer[0])
+
+    def feed(self, offset: int, data: bytes):
+        if not self.is_valid:
+            return
+        try:
+            self.received += len(data)
+            data = memoryview(data)
+
+            if offset < STL_HEADER_SIZE:
+                self._feed_header(offset, data)
+                cut = min(len(data), STL_HEADER_SIZE - offset)
+                data = data[cut:]
+                offset += cut
+            if not data:
+                return
+
+            size = STL_RECORD.itemsize
+            start = offset - STL_HEADER_SIZE
+            end = start + len(data)
+            position = start
+
+            if position % size:
+                # Rest of a record started in another piece
+                index = position // size
+                stop = min(end, (index + 1) * size)
+                self._feed_partial(index, position - index * size, data[:stop - start])
+                position = stop
+
+            full_end = end // size * size
+            if position < full_end:
+                self._store(position // size, data[position - start:full_end - start])
+                position = full_end
+
+            if position < end:
+                # Beginning of a record continued in another piece
+                self._feed_partial(position // size, 0, data[position - start:])
+        except Exception as e:
+            self.error = f'Failed to parse: {e}'
+
+    def arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        """Normalized vertices, 3 per triangle, and their keys: what merge_vertices() needs"""
+        if not self.is_complete:
+            raise ValueError(self.error or f'Only {self.received} of {self.size} bytes received')
+        if self.partial:
+            raise ValueError('Some records are incomplete')
+        return self.vertices, self.keys
+
+    def finish(self) -> 'pyvista.PolyData':
+        points, indices = merge_vertices(*self.arrays())
+        return make_polydata(points, indices.reshape(-1, 3))
+
+
+def load_streamed_vertices(vertices: np.ndarray, keys: np.ndarray) -> 'pyvista.PolyData':
+    """Mesh of BinaryStlStream.arrays() saved by another process"""
+    points, indices = merge_vertices(np.asarray(vertices), np.asarray(keys))
+    return make_polydata(points, indices.reshape(-1, 3))
+
+
+def load_ascii_stl(filename):
+    blocks = []
+    for chunk in iter_text_chunks(filename):
+        text, lines = select_lines(chunk, b'vertex')
+        if lines:
+            blocks.append(parse_rows(text, lines, 3, np.float32))
+
+    if not blocks:
+        raise ValueError('No vertices found')
+    vertices = np.concatenate(blocks)
+    if len(vertices) % 3:
+        raise ValueError('Facets are not triangles')
+
+    points, indices = merge_vertices(vertices)
+    return make_polydata(points, indices.reshape(-1, 3))
+
+
+def strip_face_extras(text: np.ndarray):
+    """'v/vt/vn' -> 'v': blanks everything from a slash to the end of the word"""
+    is_space = _is_space(text)
+    positions = np.arange(len(text), dtype=np.int32)
+    last_slash = np.maximum.accumulate(np.where(text == ord('/'), positions, -1))
+    last_space = np.maximum.accumulate(np.where(is_space, positions, -1))
+    text[last_slash > last_space] = _SPACE
+
+
+def parse_faces(text: np.ndarray, lines: int) -> tuple[np.ndarray, int]:
+    """
+    Face lines of OBJ -> VTK cells array [n, i0, ... in-1, n, ...] with 0-based indices.
+    Also returns the biggest index
+    """
+    if (text == ord('/')).any():
+        strip_face_extras(text)
+    indices = parse_numbers(text, np.int64)
+
+    if (indices <= 0).any():
+        # Relative (negative) indices depend on the position in the file
+        raise ValueError('Relative face indices are not supported')
+
+    if indices.size == 3 * lines:
+        # Only triangles - the usual case
+        faces = np.empty((lines, 4), dtype=np.int64)
+        faces[:, 0] = 3
+        faces[:, 1:] = indices.reshape(-1, 3) - 1
+        return faces.ravel(), int(indices.max()) - 1
+
+    counts = count_words_per_line(text)
+    if (counts < 3).any():
+        raise ValueError('Face with less than 3 vertices')
+    # Insert the count before every face
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return np.insert(indices - 1, starts, counts), int(indices.max()) - 1
+
+
+def load_obj(filename):
+    vertex_blocks = []
+    face_blocks = []
+    max_index = -1
+    for chunk in iter_text_chunks(filename):
+        text, lines = select_lines(chunk, b'v')
+        if lines:
+            vertex_blocks.append(parse_rows(text, lines, 3, np.float32))
+        text, lines = select_lines(chunk, b'f')
+        if lines:
+            faces, chunk_max_index = parse_faces(text, lines)
+            face_blocks.append(faces)
+            max_index = max(max_index, chunk_max_index)
+
+    if not vertex_blocks or not face_blocks:
+        raise ValueError('No vertices or faces found')
+
+    points = np.concatenate(vertex_blocks)
+    faces = np.concatenate(face_blocks)
+    if max_index >= len(points):
+        raise ValueError('Face refers to a missing vertex')
+
+    import pyvista
+    return pyvista.PolyData(points, faces)
+
+
+def load_mesh(filename) -> 'pyvista.PolyData':
+    """Fast OBJ/STL loader. Raises on anything it doesn't support"""
+    ext = filename.split('.')[-1].lower()
+    if ext == 'stl':
+        count = binary_stl_triangle_count(filename)
+        if count is not None:
+            return load_binary_stl(filename, count)
+        return load_ascii_stl(filename)
+    if ext == 'obj':
+        return load_obj(filename)
+    raise ValueError(f'Unsupported extension: {ext}')
@@ -0,0 +1,379 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, replace
+
+from src.DebugPrinter import DPrint
+from src.Visualisator.Encoder import EncoderSettings, encode_video, probe_encoder
+from src.Visualisator.SharedBuffers import FrameRing, FrameRingInfo, SharedMesh
+
+# HandlerModel and RenderPyVista (VTK, PyVista) are imported inside the worker functions:
+# the bot process only submits jobs and never loads the visualization stack
+
+
+@dataclass
+class RenderJob:
+    full_filename: str
+    frames: int = 120
+    output_filename: str | None = None  # If None - video is returned as bytes
+    encoder: EncoderSettings = EncoderSettings()
+    triangle_budget: int | None = None  # Bigger meshes are decimated. None - render as is
+    preview_size: int | None = None  # If set - only a still of this size is rendered, no video
+    window_size: tuple[int, int] = (1024, 1024)
+    # A part of a split job: only these frames are rendered into the ring, from the shared mesh
+    frame_indices: tuple[int, ...] | None = None
+    frame_ring: FrameRingInfo | None = None
+    shared_mesh: SharedMesh | None = None
+
+
+@dataclass
+class RenderResult:
+    filename: str
+    volume_mm3: float = 0.0
+    video_filename: str | None = None
+    video: bytes | None = None
+    preview: bytes | None = None  # JPEG
+    triangles: int = 0
+    is_mesh_cached: bool = False
+    timings: dict[str, float] = field(default_factory=dict)  # Stages inside the worker, seconds
+    frame_seconds: list[float] = field(default_factory=list)
+    shared_mesh: SharedMesh | None = None  # Built for a split job
+    frames_rendered: int = 0  # By a part of a split job
+
+    @property
+    def ok(self):
+        return (self.video_filename is not None or self.video is not None or self.preview is not None
+                or self.shared_mesh is not None or self.frames_rendered > 0)
+
+
+# Render context of the worker process. Lives as long as the worker
+_plotter = None
+
+
+def init_worker(encoder: EncoderSettings):
+    """Runs once when a worker process starts"""
+    from src.Visualisator.RenderPyVista import Visualizer, create_plotter
+    global _plotter
+
+    dprint = DPrint(prefix='RENDER WORKER')
+    # Ctrl+C reaches the whole process group: the pool is stopped by its owner
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    backend = probe_encoder(encoder, dprint)
+    if backend is None:
+        dprint.error('No working video encoder found')
+    else:
+        dprint(f'Pid {os.getpid()} encodes with "{backend.name}"')
+
+    try:
+        _plotter = create_plotter()
+        Visualizer.warm_up(_plotter)
+    except Exception as e:
+        dprint.error(f'Failed to warm up render context, plotter per job will be used: {e}')
+        _plotter = None
+
+
+def worker_pid():
+    return os.getpid()
+
+
+def make_video_dir(output_filename: str | None, dprint: DPrint) -> str | None:
+    """Returns None (video in memory) if the directory can't be created"""
+    if output_filename is None:
+        return None
+    try:
+        os.makedirs(os.path.dirname(output_filename) or '.', exist_ok=True)
+        return output_filename
+    except OSError as e:
+        dprint.error(f"Failed to create video directory: {e}")
+        return None
+
+
+def create_handler(job: RenderJob, dprint: DPrint):
+    from src.Visualisator.HandlerModel import HandlerModel
+
+    return HandlerModel(
+        full_filename=job.full_filename,
+        frames=job.frames,
+        dprint=dprint,
+        encoder=job.encoder,
+        output_filename=job.output_filename,
+        plotter=_plotter,
+        triangle_budget=job.triangle_budget,
+        window_size=job.window_size,
+    )
+
+
+def render_job(job: RenderJob) -> RenderResult:
+    """Render one model. Runs inside a worker process"""
+    dprint = DPrint(prefix='GifRender', is_without_repeats=False)
+    if job.frame_indices is not None:
+        return render_part(job, dprint)
+
+    result = RenderResult(filename=job.full_filename)
+    if job.preview_size is None:
+        job.output_filename = make_video_dir(job.output_filename, dprint)
+
+    handler = create_handler(job, dprint)
+    if job.preview_size is not None:
+        res = handler.preview((job.preview_size, job.preview_size))
+    else:
+        res = handler.process()
+
+    if res is None or res.image is None:
+        return result
+
+    result.volume_mm3 = res.volume_mm3
+    result.triangles = res.triangles
+    result.is_mesh_cached = res.is_mesh_cached
+    result.timings = res.timings
+    result.frame_seconds = res.frame_seconds
+
+    if job.preview_size is not None:
+        result.preview = res.image.getvalue()
+    elif isinstance(res.image, str):
+        result.video_filename = res.image
+    else:
+        result.video = res.image.getvalue()
+
+    return result
+
+
+def prepare_job(job: RenderJob) -> RenderResult:
+    """Build the mesh of a split job once and share it with the parts. Runs inside a worker process"""
+    dprint = DPrint(prefix='GifRender', is_without_repeats=False)
+    result = RenderResult(filename=job.full_filename)
+
+    handler = create_handler(job, dprint)
+    res = handler.prepare()
+    if res is None:
+        return result
+
+    result.volume_mm3 = res.volume_mm3
+    result.triangles = res.triangles
+    result.is_mesh_cached = res.is_mesh_cached
+    result.timings = res.timings
+    result.shared_mesh = SharedMesh.create(handler.pyvista_mesh, res.volume_mm3, res.triangles)
+    return result
+
+
+def render_part(job: RenderJob, dprint: DPrint) -> RenderResult:
+    """Frames of a split job into the frame ring"""
+    result = RenderResult(filename=job.full_filename)
+
+    handler = create_handler(job, dprint)
+    if job.shared_mesh is not None:
+        handler.set_mesh(job.shared_mesh.load(), job.shared_mesh.volume_mm3, job.shared_mesh.triangles)
+
+    ring = FrameRing.attach(job.frame_ring)
+    try:
+        frames_rendered = handler.capture(job.frame_indices, ring.put)
+        if frames_rendered is None:
+            # The encoder and other parts must not wait for frames that never come
+            ring.abort()
+            return result
+    finally:
+        ring.close()
+
+    result.frames_rendered = frames_rendered
+    result.timings = handler.timings
+    result.frame_seconds = handler.frame_seconds
+    return result
+
+
+def encode_job(job: RenderJob, ring_info: FrameRingInfo) -> RenderResult:
+    """Encode a split job from the frame ring as the parts fill it. Runs inside a worker process"""
+    dprint = DPrint(prefix='GifRender', is_without_repeats=False)
+    result = RenderResult(filename=job.full_filename)
+    ring = FrameRing.attach(ring_info)
+
+    def frames():
+        for index in range(job.frames):
+            frame = ring.get(index)
+            yield frame
+            # The encoder asks for the next frame when it is done with this one
+            del frame
+            ring.release(index)
+
+    ordered_frames = frames()
+    try:
+        video = encode_video(ordered_frames, make_video_dir(job.output_filename, dprint), job.encoder, dprint)
+    except Exception:
+        ring.abort()
+        raise
+    finally:
+        ordered_frames.close()
+        ring.close()
+
+    if video is None:
+        return result
+
+    result.timings['encode'] = video.encode_seconds
+    result.timings['save'] = video.save_seconds
+    if isinstance(video.target, str):
+        result.video_filename = video.target
+    else:
+        result.video = video.target.getvalue()
+    return result
+
+
+def split_frames(frames: int, parts: int) -> list[tuple[int, ...]]:
+    """
+    Frames of the orbit for each part, interleaved: parts render neighbouring frames at once,
+    so the encoder gets them in order and the frame ring can be small
+    """
+    parts = max(1, min(parts, frames))
+    return [tuple(range(part, frames, parts)) for part in range(parts)]
+
+
+class RenderPool:
+    """
+    Pool of render worker processes.
+    Keeps heavy VTK/PyVista work off the Telethon event loop
+    """
+    slots_per_part = 2  # Frame ring of a split job
+
+    def __init__(self, workers: int | None, dprint: DPrint, encoder: EncoderSettings = EncoderSettings()):
+        self.workers = workers or os.cpu_count() or 1
+        self.encoder = encoder
+        self.dprint = DPrint('RENDER POOL', base=dprint)
+        # 'spawn' - workers must not inherit the running event loop and Telethon threads
+        self.mp_context = multiprocessing.get_context('spawn')
+        self.executor: ProcessPoolExecutor | None = None
+        # Parts of a split job wait for each other, so all of them must run at once: workers are reserved
+        self.idle_workers = self.workers
+        self.idle_changed = asyncio.Condition()
+        self.reservations: deque[object] = deque()  # Waiting reserve() calls in order
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=self.mp_context,
+                initializer=init_worker,
+                initargs=(self.encoder,),
+            )
+            self.dprint(f'Started with {self.workers} workers')
+        return self
+
+    async def warm_up(self):
+        """Start every worker now, so the first user request doesn't wait for a cold start"""
+        self.start()
+        loop = asyncio.get_running_loop()
+        # Enough simultaneous tasks to make the executor spawn every worker (each one warms up in init_worker)
+        await asyncio.gather(*[
+            loop.run_in_executor(self.executor, worker_pid) for _ in range(self.workers)
+        ], return_exceptions=True)
+        self.dprint.success('Workers are warmed up')
+
+    @asynccontextmanager
+    async def reserve(self, count: int):
+        """First come, first served: a split job waiting for several workers is not overtaken by single ones"""
+        ticket = object()
+        async with self.idle_changed:
+            self.reservations.append(ticket)
+            try:
+                await self.idle_changed.wait_for(
+                    lambda: self.reservations[0] is ticket and self.idle_workers >= count)
+            finally:
+                self.reservations.remove(ticket)
+                # The next one in line may fit too
+                self.idle_changed.notify_all()
+            self.idle_workers -= count
+        try:
+            yield
+        finally:
+            async with self.idle_changed:
+                self.idle_workers += count
+                self.idle_changed.notify_all()
+
+    async def _call(self, func, job: RenderJob, *args) -> RenderResult | None:
+        """Runs func(job, *args) in a worker, None if it failed. Workers must be reserved"""
+        executor = self.start().executor
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(executor, func, job, *args)
+        except BrokenProcessPool as e:
+            # A worker died (e.g. crash inside VTK). Recreate the pool for next jobs, once
+            self.dprint.error(f'Worker crashed on "{job.full_filename}": {e}')
+            if self.executor is executor:
+                self.restart()
+            return None
+        except Exception as e:
+            self.dprint.error(f'Render of "{job.full_filename}" failed in {func.__name__}: {e}')
+            return None
+
+    async def submit(self, job: RenderJob) -> RenderResult | None:
+        async with self.reserve(1):
+            return await self._call(render_job, job)
+
+    async def submit_split(self, job: RenderJob, parts: int) -> RenderResult | None:
+        """
+        One job rendered by `parts` workers at once, the video is the same as of submit(job).
+        The mesh is built once and shared, each part renders every parts-th frame of the orbit into
+        a shared memory ring, and one more worker encodes the frames in order as they come
+        """
+        parts = min(parts, self.workers - 1, job.frames)
+        if parts <= 1:
+            return await self.submit(job)
+
+        async with self.reserve(1):
+            prepared = await self._call(prepare_job, job)
+        if prepared is None or prepared.shared_mesh is None:
+            return None
+
+        ring = None
+        try:
+            width, height = job.window_size
+            ring = FrameRing.create(parts * self.slots_per_part, (height, width, 3))
+            async with self.reserve(parts + 1):
+                encoded, *segments = await asyncio.gather(
+                    self._call_split(ring, encode_job, job, ring.info),
+                    *[self._call_split(ring, render_job, replace(
+                        job,
+                        frame_indices=indices,
+                        frame_ring=ring.info,
+                        shared_mesh=prepared.shared_mesh,
+                    )) for indices in split_frames(job.frames, parts)],
+                )
+        finally:
+            if ring is not None:
+                # Nobody waits for frames of a finished or cancelled job
+                ring.abort()
+                ring.close()
+                ring.unlink()
+            prepared.shared_mesh.unlink()
+
+        if encoded is None or not encoded.ok or any(segment is None or not segment.ok for segment in segments):
+            self.dprint.error(f'Split render of "{job.full_filename}" failed')
+            return None
+
+        result = replace(prepared, shared_mesh=None, timings=dict(prepared.timings))
+        result.video_filename = encoded.video_filename
+        result.video = encoded.video
+        result.timings.update(encoded.timings)
+        # Wall time: parts render at once
+        result.timings['render_frames'] = max(segment.timings.get('render_frames', 0.0) for segment in segments)
+        result.frame_seconds = [seconds for segment in segments for seconds in segment.frame_seconds]
+        return result
+
+    async def _call_split(self, ring: FrameRing, func, job: RenderJob, *args) -> RenderResult | None:
+        """A failed part or encoder stops the others at once, not by the ring timeout"""
+        res = await self._call(func, job, *args)
+        if res is None or not res.ok:
+            ring.abort()
+        return res
+
+    def restart(self):
+        self.shutdown(wait=False)
+        self.start()
+
+    def shutdown(self, wait=True):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=True)
+            self.executor = None
@@ -1,20 +1,69 @@
-import io
-import tempfile
-import os
+import time
 
-import imageio
 import pyvista
 import pyvista as pv
 
+from src.DebugPrinter import DPrint
+from src.Visualisator.Encoder import EncoderSettings, encode_video
+
+
+def create_plotter():
+    return pv.Plotter(off_screen=True, polygon_smoothing=True, lighting='three lights')
+
 
 class Visualizer:
-    def __init__(self, poly_data: pyvista.PolyData, frames, angle, window_size=(1024, 1024)):
+    def __init__(self, poly_data: pyvista.PolyData, frames, angle, window_size=(1024, 1024),
+                 encoder: EncoderSettings = EncoderSettings(), output_filename: str | None = None,
+                 plotter: pv.Plotter | None = None, dprint: DPrint | None = None):
+        """
+        plotter - already initialized plotter to reuse (it is not closed afterward).
+        If None - a new one is created and closed after gen_gif
+        """
+        self.dprint = dprint if dprint is not None else DPrint('VISUALIZER')
         self.poly_data = poly_data
         self.frames = frames
         self.angle = angle
         self.window_size = window_size
-        self.plotter = pv.Plotter(off_screen=True, polygon_smoothing=True, lighting='three lights')
+        self.encoder = encoder
+        self.output_filename = output_filename
+        self.is_own_plotter = plotter is None
+        self.plotter = create_plotter() if plotter is None else plotter
         self.reader = None
+        self.initial_camera = None  # Camera before the first frame, every frame is placed from it
+        # Timings of the last gen_gif, seconds
+        self.frame_seconds: list[float] = []
+        self.encode_seconds = 0.0
+        self.save_seconds = 0.0
+
+    @classmethod
+    def warm_up(cls, plotter: pv.Plotter, window_size=(1024, 1024)):
+        """Create the render window and compile shaders before the first real job"""
+        visualizer = cls(pv.Sphere(), frames=1, angle=0, window_size=window_size, plotter=plotter)
+        visualizer.add_model()
+        next(visualizer.rotate_and_capture())
+        plotter.clear_actors()
+
+    def reset_plotter(self):
+        """Bring a reused plotter back to the state of a new one"""
+        self.plotter.clear_actors()
+        self.plotter.renderer.camera = pv.Camera()
+        self.plotter.renderer.camera_set = False
+
+    def add_model(self):
+        if not self.is_own_plotter:
+            self.reset_plotter()
+
+        pv_mesh = pv.wrap(self.poly_data)
+        self.plotter.add_mesh(
+            pv_mesh,
+            color='orange',
+            lighting=True,
+            smooth_shading=False,
+            diffuse=1,
+            pbr=True,
+            metallic=1,
+            roughness=0.5,
+        )
 
     def render_frame(self):
         self.plotter.background_color = 'grey'
@@ -22,122 +71,71 @@ class Visualizer:
         img = self.plotter.screenshot()
         return img
 
-    def rotate_and_capture(self):
-        images = []
+    def set_frame_camera(self, index):
+        """
+        Camera of frame `index`, turned from the initial one at once: no error piles up from frame to frame,
+        so a frame is the same whether it is rendered alone or after the others
+        """
+        camera = self.plotter.camera
+        if self.initial_camera is None:
+            self.initial_camera = (camera.GetPosition(), camera.GetFocalPoint(), camera.GetViewUp())
+        else:
+            position, focal_point, view_up = self.initial_camera
+            camera.SetPosition(position)
+            camera.SetFocalPoint(focal_point)
+            camera.SetViewUp(view_up)
+        camera.Azimuth(self.angle * (index + 1))
+        # Like the azimuth setter: the plotter must not reset the camera on the first render
+        camera.is_set = True
+
+    def rotate_and_capture(self, frame_indices=None):
+        """
+        Yields frames one by one, so each one is encoded right after capture.
+        frame_indices - only these frames of the turntable, by default all of them
+        """
         self.plotter.window_size = self.window_size
-        for i in range(self.frames):
-            self.plotter.camera.azimuth += self.angle
-            images.append(self.render_frame())
-        return images
+        for i in range(self.frames) if frame_indices is None else frame_indices:
+            self.set_frame_camera(i)
+            start = time.perf_counter()
+            frame = self.render_frame()
+            self.frame_seconds.append(time.perf_counter() - start)
+            yield frame
+
+    def render_still(self, window_size=(384, 384)):
+        """The first frame of the turntable, small - for a quick preview"""
+        try:
+            self.add_model()
+            self.plotter.window_size = window_size
+            self.set_frame_camera(0)
+            return self.render_frame()
+        finally:
+            if self.is_own_plotter:
+                self.plotter.close()
+
+    def capture_frames(self, frame_indices, on_frame):
+        """Frames of a part of the turntable, not encoded: on_frame(index, frame) gets each one"""
+        try:
+            self.add_model()
+            for index, frame in zip(frame_indices, self.rotate_and_capture(frame_indices)):
+                on_frame(index, frame)
+        finally:
+            if self.is_own_plotter:
+                self.plotter.close()
 
     def gen_gif(self):
         if not self.poly_data.n_points:
             return None
 
         try:
-            pv_mesh = pv.wrap(self.poly_data)
-            self.plotter.add_mesh(
-                pv_mesh,
-                color='orange',
-                lighting=True,
-                smooth_shading=False,
-                diffuse=1,
-                pbr=True,
-                metallic=1,
-                roughness=0.5,
-            )
-
-            images = self.rotate_and_capture()
-
-            if not images:
-                print("No images captured")
-                return None
-
-            # Try different approaches for creating MP4
-            buffer = io.BytesIO()
-
-            try:
-                # Method 1: Try with mp4 format directly
-                writer = imageio.get_writer(
-                    buffer,
-                    format='mp4',
-                    fps=30,
-                    quality=7,
-                    pixelformat='yuv420p'
-                )
+            self.add_model()
 
-                for image in images:
-                    writer.append_data(image)
-                writer.close()
-
-            except Exception as e1:
-                print(f"Method 1 failed: {e1}")
-                buffer = io.BytesIO()
+            video = encode_video(self.rotate_and_capture(), self.output_filename, self.encoder, self.dprint)
+            if video is None:
+                return None
 
-                try:
-                    # Method 2: Try with ffmpeg-imageio plugin
-                    writer = imageio.get_writer(
-                        buffer,
-                        format='ffmpeg',
-                        fps=30,
-                        codec='libx264',
-                        quality=7,
-                        pixelformat='yuv420p'
-                    )
-
-                    for image in images:
-                        writer.append_data(image)
-                    writer.close()
-
-                except Exception as e2:
-                    print(f"Method 2 failed: {e2}")
-
-                    try:
-                        # Method 3: Create temporary file and read it back
-                        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-                            temp_filename = temp_file.name
-
-                        writer = imageio.get_writer(
-                            temp_filename,
-                            fps=30,
-                            quality=7,
-                            pixelformat='yuv420p'
-                        )
-
-                        for image in images:
-                            writer.append_data(image)
-                        writer.close()
-
-                        # Read the file back into buffer
-                        with open(temp_filename, 'rb') as f:
-                            buffer.write(f.read())
-
-                        # Clean up temporary file
-                        os.unlink(temp_filename)
-
-                    except Exception as e3:
-                        print(f"Method 3 failed: {e3}")
-
-                        # Method 4: Fall back to GIF if MP4 fails
-                        try:
-                            buffer = io.BytesIO()
-                            writer = imageio.get_writer(
-                                buffer,
-                                format='gif',
-                                duration=1 / 30,
-                                loop=0
-                            )
-
-                            for image in images:
-                                writer.append_data(image)
-                            writer.close()
-
-                        except Exception as e4:
-                            print(f"All methods failed. Last error: {e4}")
-                            return None
-
-            buffer.seek(0)
-            return buffer
+            self.encode_seconds = video.encode_seconds
+            self.save_seconds = video.save_seconds
+            return video.target
 
         except Exception as e:
             print(f"Error in gen_gif: {e}")
@@ -145,7 +143,7 @@ class Visualizer:
             traceback.print_exc()
             return None
         finally:
-            if self.plotter is not None:
+            if self.is_own_plotter and self.plotter is not None:
                 try:
                     self.plotter.close()
                 except:
@@ -0,0 +1,173 @@
+import math
+import time
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pyvista
+
+# Blocks are created and attached by any process of the pool and unlinked by the bot process once.
+# Spawned workers share the resource tracker of the bot process, so nothing is left if it dies
+
+
+class RingAborted(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    """NumPy array in a shared memory block. Only the name and the layout are pickled"""
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+    @classmethod
+    def create(cls, array: np.ndarray) -> 'SharedArray':
+        """Copies the array into a new block, which lives until unlink()"""
+        array = np.ascontiguousarray(array)
+        shm = SharedMemory(create=True, size=max(1, array.nbytes))
+        try:
+            np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+        finally:
+            shm.close()
+        return cls(shm.name, array.shape, array.dtype.str)
+
+    def copy(self) -> np.ndarray:
+        """Process-local copy: no view of the block outlives the call"""
+        shm = SharedMemory(self.name)
+        try:
+            return np.ndarray(self.shape, np.dtype(self.dtype), buffer=shm.buf).copy()
+        finally:
+            shm.close()
+
+    def unlink(self):
+        try:
+            shm = SharedMemory(self.name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+@dataclass(frozen=True)
+class SharedMesh:
+    """Mesh handed to workers as shared arrays instead of a pickled vtkPolyData"""
+    points: SharedArray
+    faces: SharedArray  # VTK cells layout
+    volume_mm3: float  # Of the original mesh, before decimation
+    triangles: int  # Of the original mesh
+
+    @classmethod
+    def create(cls, mesh: 'pyvista.PolyData', volume_mm3: float, triangles: int) -> 'SharedMesh':
+        points = SharedArray.create(mesh.points)
+        try:
+            faces = SharedArray.create(mesh.faces)
+        except Exception:
+            points.unlink()
+            raise
+        return cls(points, faces, volume_mm3, triangles)
+
+    def load(self) -> 'pyvista.PolyData':
+        # VTK keeps references to the arrays as long as the plotter keeps the actor,
+        # so they are copied: the blocks can be closed right away
+        import pyvista
+        return pyvista.PolyData(self.points.copy(), self.faces.copy())
+
+    def unlink(self):
+        self.points.unlink()
+        self.faces.unlink()
+
+
+@dataclass(frozen=True)
+class FrameRingInfo:
+    name: str
+    slots: int
+    frame_shape: tuple[int, int, int]  # height, width, RGB
+
+
+class FrameRing:
+    """
+    Frames handed from render processes to the encoder through shared memory, without pickling.
+    Frame i goes to slot i % slots: it is written when the encoder has taken frame i - slots,
+    and read when the slot holds it. Frames take tens of milliseconds, so waiting is polling.
+    Any side can abort(), then waiting on every side raises RingAborted
+    """
+    poll_seconds = 0.002
+    timeout = 300.0  # Seconds without progress
+
+    # Header, int64: aborted, frames consumed by the encoder, index of the frame in every slot (-1 - empty)
+    _ABORTED = 0
+    _CONSUMED = 1
+    _SLOTS = 2
+
+    def __init__(self, shm: SharedMemory, info: FrameRingInfo):
+        self.shm = shm
+        self.info = info
+        self.header = np.ndarray((self._SLOTS + info.slots,), np.int64, buffer=shm.buf)
+        self.frames = np.ndarray((info.slots, *info.frame_shape), np.uint8, buffer=shm.buf, offset=self.header.nbytes)
+
+    @classmethod
+    def create(cls, slots: int, frame_shape: tuple[int, int, int]) -> 'FrameRing':
+        size = 8 * (cls._SLOTS + slots) + slots * math.prod(frame_shape)
+        shm = SharedMemory(create=True, size=size)
+        ring = cls(shm, FrameRingInfo(shm.name, slots, tuple(frame_shape)))
+        ring.header[:cls._SLOTS] = 0
+        ring.header[cls._SLOTS:] = -1
+        return ring
+
+    @classmethod
+    def attach(cls, info: FrameRingInfo) -> 'FrameRing':
+        return cls(SharedMemory(info.name), info)
+
+    @property
+    def is_aborted(self):
+        return bool(self.header[self._ABORTED])
+
+    def abort(self):
+        self.header[self._ABORTED] = 1
+
+    def _wait(self, is_ready, what):
+        start = time.monotonic()
+        while not is_ready():
+            if self.is_aborted:
+                raise RingAborted(f'Aborted while waiting for {what}')
+            if time.monotonic() - start > self.timeout:
+                self.abort()
+                raise TimeoutError(f'No progress in {self.timeout:.0f} s while waiting for {what}')
+            time.sleep(self.poll_seconds)
+
+    def put(self, index: int, frame: np.ndarray):
+        """Renderer side"""
+        if frame.shape != self.info.frame_shape:
+            self.abort()
+            raise ValueError(f'Frame of shape {frame.shape}, expected {self.info.frame_shape}')
+
+        slot = index % self.info.slots
+        self._wait(lambda: self.header[self._CONSUMED] > index - self.info.slots, f'a slot for frame {index}')
+        self.frames[slot] = frame
+        # Published after the pixels are written
+        self.header[self._SLOTS + slot] = index
+
+    def get(self, index: int) -> np.ndarray:
+        """Encoder side. The view is valid until release(index)"""
+        slot = index % self.info.slots
+        self._wait(lambda: self.header[self._SLOTS + slot] == index, f'frame {index}')
+        return self.frames[slot]
+
+    def release(self, index: int):
+        self.header[self._SLOTS + index % self.info.slots] = -1
+        self.header[self._CONSUMED] = index + 1
+
+    def close(self):
+        del self.header, self.frames
+        try:
+            self.shm.close()
+        except BufferError:
+            # A view returned by get() is still referenced (e.g. by a traceback), the mapping goes with it
+            pass
+
+    def unlink(self):
+        self.shm.unlink()
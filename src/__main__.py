@@ -1,6 +1,10 @@
+import argparse
 import asyncio
 import signal
 import contextlib
+import sys
+
+from src import BatchRender, RenderWorker
 from src.Client import Logic
 
 
@@ -44,8 +48,24 @@ async def main():
                     await maybe_awaitable
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m src')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('bot', help='Run the Telegram bot (default)')
+    BatchRender.add_arguments(commands.add_parser(
+        'render', help='Render models of directories or glob patterns into the cache of the bot, without Telegram'))
+    RenderWorker.add_arguments(commands.add_parser(
+        'worker', help='Render jobs of the bot from its job queue (render.job_queue of the config)'))
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    args = parse_args()
     try:
+        if args.command == 'render':
+            sys.exit(asyncio.run(BatchRender.main(args)))
+        if args.command == 'worker':
+            sys.exit(asyncio.run(RenderWorker.main(args)))
         asyncio.run(main())
     except KeyboardInterrupt:
         # Swallow the Ctrl+C so it doesn't print a traceback
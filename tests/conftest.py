@@ -0,0 +1,15 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Tests import the bot as the `src` package, the same as `python -m src`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.LogSink import sink, LogSettings
+
+
+@pytest.fixture(autouse=True, scope='session')
+def log_file(tmp_path_factory):
+    """The log of the tests is not mixed into the log of the bot"""
+    sink.configure(LogSettings(filename=str(tmp_path_factory.mktemp('log') / 'test_log.log')))
@@ -0,0 +1,82 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from src.DebugPrinter import DPrint
+from src.Downloader import FileDownloaderFromMessage
+
+REQUEST_SIZE = 1024
+RANGE_SIZE = 4 * REQUEST_SIZE
+DATA = os.urandom(5 * RANGE_SIZE + 100)
+
+
+class FakeClient:
+    """iter_download of Telethon over DATA. Requests at fail_at and after it fail"""
+
+    def __init__(self, fail_at: int | None = None):
+        self.fail_at = fail_at
+        self.offsets = []
+
+    async def iter_download(self, media, offset=0, limit=None, request_size=REQUEST_SIZE, file_size=None):
+        self.offsets.append(offset)
+        requests = 0
+        while offset < len(DATA) and (limit is None or requests < limit):
+            if self.fail_at is not None and offset >= self.fail_at:
+                raise ConnectionError('Connection lost')
+            await asyncio.sleep(0)
+            yield DATA[offset:offset + request_size]
+            offset += request_size
+            requests += 1
+
+
+def make_downloader(client, directory, connections=2, on_data=None):
+    msg = SimpleNamespace(file=SimpleNamespace(size=len(DATA)), media=object())
+    downloader = FileDownloaderFromMessage(
+        client, msg, 'model.stl', 20, DPrint('TEST'),
+        connections=connections, range_size=RANGE_SIZE, request_size=REQUEST_SIZE, on_data=on_data)
+    downloader.path_full = f'{directory}/'
+    asyncio.run(downloader.cache_full_filenames())
+    return downloader
+
+
+def test_ranges_resume(tmp_path):
+    failing = make_downloader(FakeClient(fail_at=3 * RANGE_SIZE), tmp_path)
+    with pytest.raises(ConnectionError):
+        asyncio.run(failing.run())
+    done_ranges = failing.read_done_ranges()
+    assert done_ranges and len(done_ranges) < failing.ranges_count
+
+    received = bytearray(len(DATA))
+
+    def on_data(offset, data):
+        received[offset:offset + len(data)] = data
+
+    client = FakeClient()
+    downloader = make_downloader(client, tmp_path, on_data=on_data)
+    filename = asyncio.run(downloader.run())
+
+    # Ranges downloaded before are not requested again, but their bytes are fed to on_data
+    assert not {offset // RANGE_SIZE for offset in client.offsets} & done_ranges
+    assert bytes(received) == DATA
+    with open(filename, 'rb') as f:
+        assert f.read() == DATA
+    assert not os.path.exists(downloader.filename_full_ranges)
+    assert not os.path.exists(downloader.filename_full_stub)
+
+
+def test_sequential_stub_resumed_by_ranges(tmp_path):
+    failing = make_downloader(FakeClient(fail_at=2 * RANGE_SIZE + REQUEST_SIZE), tmp_path, connections=1)
+    with pytest.raises(ConnectionError):
+        asyncio.run(failing.run())
+    assert failing.read_done_ranges() is None
+
+    client = FakeClient()
+    downloader = make_downloader(client, tmp_path)
+    filename = asyncio.run(downloader.run())
+
+    # The whole ranges of the stub prefix are kept
+    assert min(client.offsets) == 2 * RANGE_SIZE
+    with open(filename, 'rb') as f:
+        assert f.read() == DATA
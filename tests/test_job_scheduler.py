@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from src.DebugPrinter import DPrint
+from src.JobScheduler import JobScheduler, QueueFullError
+
+
+def make_scheduler(**kwargs):
+    options = dict(concurrency=1, per_user_in_flight=1, max_queue=100, max_queue_per_user=100)
+    options.update(kwargs)
+    return JobScheduler(dprint=DPrint('TEST'), **options)
+
+
+def test_users_take_turns():
+    async def main():
+        scheduler = make_scheduler()
+        started = []
+        release = asyncio.Event()
+
+        def job(name):
+            async def run():
+                started.append(name)
+                await release.wait()
+                return name
+            return run
+
+        jobs = [asyncio.create_task(scheduler.submit(1, job(f'A{i}'), cost=1.0)) for i in range(3)]
+        await asyncio.sleep(0)
+        jobs += [asyncio.create_task(scheduler.submit(2, job(f'B{i}'), cost=1.0)) for i in range(2)]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*jobs)
+        return started
+
+    assert asyncio.run(main()) == ['A0', 'B0', 'A1', 'B1', 'A2']
+
+
+def test_lanes_share_the_only_slot():
+    async def main():
+        scheduler = make_scheduler(per_user_in_flight=2, heavy_concurrency=1)
+        running, most = 0, 0
+        release = asyncio.Event()
+
+        async def run():
+            nonlocal running, most
+            running += 1
+            most = max(most, running)
+            await release.wait()
+            running -= 1
+
+        jobs = [asyncio.create_task(scheduler.submit(1, run, cost=cost)) for cost in (1.0, None, 1.0, 600.0)]
+        await asyncio.sleep(0)
+        assert [lane.concurrency for lane in scheduler.lanes] == [1, 1]
+        assert scheduler.running == 1
+        release.set()
+        await asyncio.gather(*jobs)
+        return most
+
+    assert asyncio.run(main()) == 1
+
+
+def test_per_user_in_flight():
+    async def main():
+        scheduler = make_scheduler(concurrency=4, heavy_concurrency=1)
+        release = asyncio.Event()
+
+        async def run():
+            await release.wait()
+
+        jobs = [asyncio.create_task(scheduler.submit(user_id, run, cost=1.0)) for user_id in (1, 1, 2)]
+        await asyncio.sleep(0)
+        running = scheduler.in_flight.copy()
+        queued = scheduler.queued
+        release.set()
+        await asyncio.gather(*jobs)
+        return running, queued
+
+    assert asyncio.run(main()) == ({1: 1, 2: 1}, 1)
+
+
+def test_queue_full():
+    async def main():
+        scheduler = make_scheduler(max_queue=3, max_queue_per_user=2)
+        release = asyncio.Event()
+
+        async def run():
+            await release.wait()
+
+        # The first one runs, the next two wait
+        jobs = [asyncio.create_task(scheduler.submit(1, run, cost=1.0)) for _ in range(3)]
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await scheduler.submit(1, run, cost=1.0)
+
+        jobs.append(asyncio.create_task(scheduler.submit(2, run, cost=1.0)))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await scheduler.submit(3, run, cost=1.0)
+
+        release.set()
+        await asyncio.gather(*jobs)
+        assert scheduler.queued == 0
+
+    asyncio.run(main())
+
+
+def test_queue_positions():
+    async def main():
+        scheduler = make_scheduler()
+        release = asyncio.Event()
+        positions = {}
+
+        async def run():
+            await release.wait()
+
+        def on_position(name):
+            async def report(position):
+                positions.setdefault(name, []).append(position)
+            return report
+
+        jobs = [asyncio.create_task(scheduler.submit(user_id, run, on_position(name), cost=1.0))
+                for name, user_id in (('A0', 1), ('A1', 1), ('B0', 2))]
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        waiting = {name: reported[-1] for name, reported in positions.items()}
+        release.set()
+        await asyncio.gather(*jobs)
+        return waiting
+
+    # B0 goes before the second job of the user already served
+    assert asyncio.run(main()) == {'B0': 1, 'A1': 2}
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from src.DebugPrinter import DPrint
+from src.RenderCache import RenderCache
+
+
+def make_video(directory, key):
+    filename = str(directory / f'{key}.mp4')
+    with open(filename, 'wb') as f:
+        f.write(b'video')
+    return filename
+
+
+def test_saves_of_two_processes_are_merged(tmp_path):
+    bot = RenderCache(str(tmp_path), DPrint('BOT'))
+    batch = RenderCache(str(tmp_path), DPrint('BATCH'))
+
+    bot.put('a', make_video(tmp_path, 'a'), 1.0)
+    bot.link_document(1, 'params', 'a')
+    # Loaded before the saves of the bot: they are kept by its own save
+    batch.put('b', make_video(tmp_path, 'b'), 2.0)
+    batch.link_document(2, 'params', 'b')
+
+    index = RenderCache(str(tmp_path), DPrint('NEW'))
+    assert set(index.renders) == {'a', 'b'}
+    assert index.documents == {'1:params': 'a', '2:params': 'b'}
+
+
+def test_changes_of_others_are_seen(tmp_path):
+    bot = RenderCache(str(tmp_path), DPrint('BOT'))
+    batch = RenderCache(str(tmp_path), DPrint('BATCH'))
+
+    batch.put('b', make_video(tmp_path, 'b'), 2.0)
+    batch.link_document(2, 'params', 'b')
+
+    assert bot.get('b').volume_mm3 == 2.0
+    assert bot.get_by_document(2, 'params').key == 'b'
+
+
+def test_own_changes_win(tmp_path):
+    bot = RenderCache(str(tmp_path), DPrint('BOT'))
+    batch = RenderCache(str(tmp_path), DPrint('BATCH'))
+    bot.put('a', make_video(tmp_path, 'a'), 1.0)
+    batch.get('a')
+
+    bot.remember_document('a', SimpleNamespace(id=7, access_hash=8, file_reference=b'\x01'))
+    # The stale entry of the batch doesn't overwrite the document of the bot
+    batch.put('b', make_video(tmp_path, 'b'), 2.0)
+
+    index = RenderCache(str(tmp_path), DPrint('NEW'))
+    assert index.renders['a'].input_document.id == 7
+    assert 'b' in index.renders